@@ -144,8 +144,8 @@ def main():
 
     #Input
     sequences = sfio.read_fasta(args.fasta)
-    xstraints = sfio.read_react(args.react) if args.react else None
     restrict = sfio.read_restrict(args.restrict) if args.restrict else None
+    xstraints = sfio.read_react(args.react,restrict) if args.react else None
 
     #Populate and filter errors
     errors = {}
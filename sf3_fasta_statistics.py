@@ -23,7 +23,7 @@ def write_comp_csv(data,outfyle,thres,colname,rnumb=7):
     fracts = {k:float(v)/total for k, v in overall.items()}
     passing = sorted(dict(filter(lambda x: x[1]>=thres2, fracts.items())).keys())
     header = ','.join([colname]+[key+'_percent' for key in passing]+['length'])
-    with open(outfyle,'w') as g:
+    with sfio.open_text(outfyle,'w') as g:
         g.write(header+'\n')
         for seq_name,seq_data in data.items():
             sub_total = sum(seq_data.values())
@@ -8,16 +8,17 @@ include the transcripts above the accepted coverage threshold, and must be the e
 #Imports
 import sys
 import argparse
+import numpy
 import sf3libs.sf3io as sfio
 
 #Functions
 def sum_react(react_dict):
-    '''Sum of all the reactivities'''
-    return sum([sum(filter(lambda x: isinstance(x, float), v)) for v in react_dict.values()])
+    '''Sum of all the reactivities, NaN values are skipped'''
+    return sum([sum(v[~numpy.isnan(v)].tolist()) for v in react_dict.values()])
 
 def apply_correction(react_dict,correction):
-    '''Applies a correction to all values'''
-    return {k:[x*correction if x!= 'NA' else 'NA' for x in v] for k, v in react_dict.items()}
+    '''Applies a correction to all values, NaN stays NaN'''
+    return {k:v*correction for k, v in react_dict.items()}
 
 #Main Function
 def main():
@@ -30,7 +31,7 @@ def main():
     args = parser.parse_args()
 
     #Sum all reactivities
-    cold_react,hot_react = map(sfio.read_react,[args.lower,args.higher])
+    cold_react,hot_react = [sfio.read_react(fyle,as_array=True) for fyle in [args.lower,args.higher]]
     cold_sum,hot_sum = map(sum_react,[cold_react,hot_react])
 
     #Check files
@@ -51,10 +52,10 @@ def main():
     new_cold = apply_correction(cold_react,cold_correction)
   
     #Write Out
-    cold_name = args.lower.replace('.react','_'+args.suffix+'.react')
-    hot_name = args.higher.replace('.react','_'+args.suffix+'.react')
-    sfio.write_react(new_cold,l_name)
-    sfio.write_react(new_hot,h_name)
+    cold_name = sfio.rx_rename(args.lower,'_'+args.suffix+'.react')
+    hot_name = sfio.rx_rename(args.higher,'_'+args.suffix+'.react')
+    sfio.write_react(new_cold,cold_name)
+    sfio.write_react(new_hot,hot_name)
 
 if __name__ == '__main__': 
     main()
@@ -12,16 +12,16 @@ def write_out_stats(data,outfyle,trim,minlen):
     transcript_keys = sorted(data.keys())
     types = ['_max','_average','_std','_gini']
     header = ['transcript']+[fyle+mod for fyle in f_keys for mod in types]
-    with open(outfyle,'w') as g:
+    with sfio.open_text(outfyle,'w') as g:
         g.write(','.join(header)+'\n')
         for transcript in transcript_keys:
-            sub,new = data[transcript],[]
+            sub,new = data[transcript],[transcript]
             for fyle in f_keys:
                 if fyle in sub:
                     new.extend(ReactStats(sub[fyle],trim,minlen).as_list())
                 else:
                     new.extend(ReactStats().as_list())
-            g.write(','.join(new)+'\n')
+            g.write(','.join(map(str,new))+'\n')
 
 def main():
     parser = argparse.ArgumentParser(description='Generates a simple statistical summary for <.react> files.')
@@ -35,22 +35,18 @@ def main():
     out_files.add_argument('-name',default=None,help='Specify output file name')
     args = parser.parse_args()
 
-    #File Input
-    rx_data = sfio.read_rx_files(sorted(args.react),'.react',verbose=False)
-    
-    #Filter by coverage
+    #File Input, limited to the restricted transcripts if enabled
     restrict = sfio.read_restrict(args.restrict) if args.restrict else None
-    if restrict:
-            rx_data = {n:s for n,s in rx_data.items() if n in restrict}
+    rx_data = sfio.read_rx_files(sorted(args.react),'react',verbose=False,restrict=restrict,as_array=True)
 
     #Nomenclature
-    name_1 = sorted([x.replace('.react','') for x in in_files])
+    name_1 = sorted([sfio.rx_stem(x) for x in args.react])
     name_2 = [str(qq)+q for qq,q in zip([args.trim,args.minlen],['trim','minlen'])]
     default_name = '_'.join(name_1+name_2+['statistics'])+'.csv'
     out_name = sfio.check_extension(args.name,'.csv') if args.name else default_name
 
     #Write Out File
-    write_out_stats(data,out_name,args.trim,args.minlen)
+    write_out_stats(rx_data,out_name,args.trim,args.minlen)
 
 if __name__ == '__main__':
     main()
@@ -13,7 +13,7 @@ import sf3libs.sf3io as sfio
 #Functions
 def write_out_csv(sequence,values,outfile='stats.csv'):
     '''Writes out the data'''
-    with open(outfile,'w') as g:
+    with sfio.open_text(outfile,'w') as g:
         g.write(','.join(['Position','Nucleotide','Reactivity'])+'\n')
         lines = zip(range(1,len(sequence)+1),sequence,values)
         for line in lines:
@@ -26,7 +26,7 @@ def batch_write_out_csv(sequence_dict,values_dict,name_suffix,outdyr):
         new_fyle = os.path.join(outdyr,'_'.join([key,name_suffix])+'.csv')
         sequence, values = sequence_dict[key],values_dict[key]
         if len(sequence) == len(values):
-            with open(new_fyle,'w') as g:
+            with sfio.open_text(new_fyle,'w') as g:
                 g.write(','.join(['Position','Nucleotide','Reactivity'])+'\n')
                 lines = zip(range(1,len(sequence)+1),sequence,values)
                 for line in lines:
@@ -50,7 +50,7 @@ def main():
     #Single Transcript Mode
     if args.mode == 'S':
         #Get data
-        outname= '_'.join([args.name,args.react.replace('.react','')])+'.csv'
+        outname= '_'.join([args.name,sfio.rx_stem(args.react)])+'.csv'
         seq = sequences[args.name] if args.name in sequences else None
         reacts = reactivities[args.name] if args.name in reactivities else None
         #Write
@@ -65,14 +65,14 @@ def main():
     #Multi Mode
     elif args.mode == 'M':
         #Directory
-        new_dir = args.outdir if args.outdir else args.react.replace('.react','')+'_'+'all_csvs'
+        new_dir = args.outdir if args.outdir else sfio.rx_stem(args.react)+'_'+'all_csvs'
         if args.restrict:
             covered = sfio.read_restrict(args.restrict)
             sequences = {n:s for n,s in sequences.items() if n in covered}
             reactivities = {n:s for n,s in reactivities.items() if n in covered}
         if new_dir not in os.listdir('.'):
             os.mkdir(new_dir)
-            batch_write_out_csv(sequences,reactivities,args.react.replace('.react',''),new_dir)
+            batch_write_out_csv(sequences,reactivities,sfio.rx_stem(args.react),new_dir)
         else:
             print('{} folder already exists. Remove or rename and try again.'.format(new_dir))
 
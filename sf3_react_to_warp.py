@@ -6,12 +6,14 @@ import sf3libs.sf3io as sfio
 
 #Functions
 def write_warp(seqz,rctz,out='file.warp'):
-    '''Writes out a warp file'''
-    key_set = seqz.keys() & rctz.keys()
+    '''Writes out a warp file, rctz may be a dictionary or a stream of (name,reactivities)'''
+    items = rctz.items() if hasattr(rctz,'items') else rctz
     subs = {'0.0':'NaN','Na':'NaN'}
-    with open(out,'w') as g:
-        for key in key_set:
-            new = [str(x) for x in rctz[key]]
+    with sfio.open_text(out,'w') as g:
+        for key,values in items:
+            if key not in seqz:
+                continue
+            new = [str(x) for x in values]
             CLEAN = ','.join([subs[q] if q in subs else q for q in new])
             g.write(key+'\n')
             g.write(seqz[key]+'\n')
@@ -29,17 +31,12 @@ def main():
     out_files.add_argument('-name',type=str,default=None,help='Output ShapeWarp file')
     args = parser.parse_args()
 
-    #File Input
-    seqs,rct = sfio.read_fasta(args.fasta),sfio.read_react(args.react)
-
-    #Filter by coverage
+    #File Input, limited to the restricted transcripts if enabled
     restrict = sfio.read_restrict(args.restrict) if args.restrict else None
-    if restrict:
-            seqs = {n:s for n,s in seqs.items() if n in restrict}
-            rcts = {a:b for a,b in rct.items() if a in restrict}
+    seqs,rct = sfio.read_fasta(args.fasta),sfio.iter_react(args.react,restrict)
 
     #Nomenclature
-    default_name = args.react.replace('.react','.warp')
+    default_name = sfio.rx_rename(args.react,'.warp')
     out_name = sfio.check_extension(args.name,'.warp') if args.name else default_name
 
     #Write Out
@@ -2,41 +2,103 @@
 
 #Imports
 import argparse
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor,wait
+import numpy
 import sf3libs.sf3io as sfio
 
 #Functions
+def combine_stops(stops_lyst):
+    '''Sums the stops of one transcript from several files as integer arrays, cut to the shortest as zip would'''
+    size = min(len(stops) for stops in stops_lyst)
+    total = numpy.array(stops_lyst[0][:size],dtype=numpy.int64)
+    for stops in stops_lyst[1:]:
+        total += stops[:size]
+    return total
+
 def merge_rtsc(rtsc_lyst):
     '''Takes a list of <.rtsc> files, returns a dictionary that is sum of the RT stops'''
-    all_stops= {}
+    all_stops = {}
     for rtsc in sorted(rtsc_lyst):
-        data = sfio.read_in_rtsc(rtsc)
-        for transcript, values in data.items():
+        for transcript, values in sfio.iter_rtsc(rtsc,as_array=True):
             if transcript in all_stops:
-                current_values = all_stops[transcript]
-                all_stops[transcript] = [sum(spot) for spot in zip(current_values,values)]
+                all_stops[transcript] = combine_stops([all_stops[transcript],values])
             else:
                 all_stops[transcript] = values
     return all_stops
 
+def prefetched(iterator,executor,batch_size=256):
+    '''Yields from an iterator while a thread of executor reads its next batch'''
+    take = lambda: list(itertools.islice(iterator,batch_size))
+    pending = executor.submit(take)
+    while True:
+        batch = pending.result()
+        if not batch:
+            return
+        pending = executor.submit(take)
+        yield from batch
+
+def indexed_rtsc(rtsc_lyst,executor,skip=(),sort_flag=False,batch_size=256):
+    '''Yields the summed (transcript,stops) of files in first seen order (or sorted), fetching each through the files' indexes.
+    Transcripts in skip were already yielded, the files are closed once done or abandoned.
+    Compressed files cannot be seeked, so they are merged in memory instead'''
+    if any(rtsc.endswith('.gz') for rtsc in rtsc_lyst):
+        items = [(transcript,stops) for transcript,stops in merge_rtsc(rtsc_lyst).items() if transcript not in skip]
+        yield from (sorted(items,key=lambda item: item[0]) if sort_flag else items)
+        return
+    with contextlib.ExitStack() as stack:
+        pending = [executor.submit(stack.enter_context,sfio.rtsc_reader(rtsc)) for rtsc in rtsc_lyst]
+        wait(pending)
+        readers = [future.result() for future in pending]
+        order = [transcript for transcript in dict.fromkeys(itertools.chain(*[names for names,read in readers])) if transcript not in skip]
+        order = sorted(order) if sort_flag else order
+        present = [set(names) for names,read in readers]
+        fetch = lambda reader,names,chunk: [reader[1](transcript) if transcript in names else None for transcript in chunk]
+        for i in range(0,len(order),batch_size):
+            chunk = order[i:i+batch_size]
+            fetched = list(executor.map(fetch,readers,present,[chunk]*len(readers)))
+            for j,transcript in enumerate(chunk):
+                yield transcript,combine_stops([stops[j] for stops in fetched if stops[j] is not None])
+
+def stream_rtsc(rtsc_lyst,sort_flag=False,threads=4):
+    '''Yields the summed (transcript,stops) of <.rtsc> files, holding about one batch of transcripts per file at a time.
+    Files are walked in lockstep, read ahead by threads, while they list the same transcripts in the same order.
+    From the first difference on, or if sorting, the remaining transcripts are fetched by index instead'''
+    rtsc_lyst = sorted(rtsc_lyst)
+    with ThreadPoolExecutor(max(threads,1)) as executor:
+        done = set()
+        if not sort_flag:
+            streams = [prefetched(sfio.iter_rtsc(rtsc,as_array=True),executor) for rtsc in rtsc_lyst]
+            for entries in itertools.zip_longest(*streams):
+                if None in entries or len({transcript for transcript,stops in entries}) > 1:
+                    break
+                done.add(entries[0][0])
+                yield entries[0][0],combine_stops([stops for transcript,stops in entries])
+            else:
+                return
+            for stream in streams:
+                stream.close()
+        yield from indexed_rtsc(rtsc_lyst,executor,done,sort_flag)
+
 def main():
     parser = argparse.ArgumentParser(description='Combines <.rtsc> files, typically replicates of the same sample')
     in_files = parser.add_argument_group('Input')
     in_files.add_argument('rtsc',help='Input <.rtsc> files',nargs='+')
+    settings = parser.add_argument_group('Settings')
+    settings.add_argument('-threads',type=int,default=4,metavar='<number>',help='[default = 4] Threads reading the input files')
     out_files = parser.add_argument_group('Output')
     out_files.add_argument('-sort',action='store_true',default=False,help='Sort output by transcript name')
     out_files.add_argument('-name',default=None,help='Specify output file name')
     args = parser.parse_args()
 
     #Generate name or assign the user provided name
-    default_name = '_'.join(sorted([x.replace('.rtsc','') for x in args.rtsc]))+'.rtsc'
+    default_name = '_'.join(sorted([sfio.rx_stem(x) for x in args.rtsc]))+'.rtsc'
     out_name = default_name if args.name == None else sfio.check_extension(args.name,'.rtsc')
 
-    #Pool all <.rtsc> into a dictionary
-    all_stops = merge_rtsc(args.rtsc)
-
-    #Write out the dictionary
-    sfio.write_rtsc(all_stops,args.sort,out_name)
+    #Sum all <.rtsc> transcript by transcript, writing each as it is combined
+    sfio.write_rtsc(stream_rtsc(args.rtsc,args.sort,args.threads),out_name)
 
 
-if __name__ == '__main__': 
+if __name__ == '__main__':
     main()
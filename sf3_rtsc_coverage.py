@@ -1,61 +1,23 @@
 #!/usr/bin/env python3
 
 #Imports
-import glob
 import argparse
-import collections
 import sf3libs.sf3io as sfio
+import sf3libs.sf3scan as sfscan
 
 #Functions
-def rtsc_coverage(rtsc_file,fasta_index,specificity='AC'):
-    '''Generates a coverage dictionary for an <.rtsc> file with a given specificity'''
-    rtsc_data,coverage = sfio.read_rtsc(rtsc_file), {}
-    for transcript,stops in rtsc_data.items():
-        effective_sequence = fasta_index[transcript].upper()[:-1]
-        effective_stops = stops[1:]
-        matched = zip(effective_sequence,effective_stops)
-        specific_bases_seq = sum([v for k, v in collections.Counter(effective_sequence).items() if k in specificity])
-        specific_bases_stops = sum([item[1] for item in filter(lambda x: x[0] in specificity, matched)])
-        try:
-            coverage[transcript] = float(specific_bases_stops)/specific_bases_seq
-        except ZeroDivisionError:
-            coverage[transcript] = 0
-    return coverage
-
 def collect_coverages(fyle_list,fasta_fyle,specificity='AC'):
-    '''Applies rtsc_coverage to files'''
-    fasta_index,coverage_data = sfio.read_fasta(fasta_fyle),{}
-    for fyle in fyle_list:
-        coverage_data[fyle.replace('.rtsc','')] = rtsc_coverage(fyle,fasta_index,specificity)
-    return coverage_data
-
-def write_coverage(data,out_fyle='derp.csv'):
-    '''Writes out coverages'''
-    h_keys = sorted(data.keys())
-    v_keys = sorted(list(set.union(*map(set, data.values()))))
-    header = ','.join(['transcript']+[derp+'_coverage' for derp in h_keys])
-    with open(out_fyle,'w') as g:
-        g.write(header+'\n')
-        for transcript in v_keys:
-            entry = [str(data[h_key].get(transcript,'NA')) for h_key in h_keys]
-            out_line = ','.join([transcript]+entry)
-            g.write(out_line+'\n')
-
-def write_ol(data,out_fyle='derp.txt',threshold=1.0):
-    '''Writes out an overlap file'''
-    h_keys = sorted(data.keys())
-    shared_transcripts = sorted(list(set.intersection(*map(set, data.values()))))
-    with open(out_fyle,'w') as g:
-        for transcript in shared_transcripts:
-            passing = all([data[h_key][transcript] >= threshold for h_key in h_keys])
-            if passing:
-                g.write(transcript+'\n')
+    '''Scans files into a transcript by file CoverageMatrix'''
+    reference = sfscan.ReferenceIndex(sfio.read_fasta(fasta_fyle),[specificity])
+    scans = sfscan.scan_files(fyle_list,reference,[specificity],letters=False)
+    return sfscan.coverage_matrix(scans,reference,specificity)
 
 def main():
     parser = argparse.ArgumentParser(description='Calculates RT stop coverage from <.rtsc> file(s)')
     in_files = parser.add_argument_group('Input')
     in_files.add_argument('fasta',type=str,metavar='fasta',help='Reference Fasta')
     in_files.add_argument('f',type=str,help='Input <.rtsc> files', nargs='+')
+    in_files.add_argument('-update',type=str,default=None,metavar='<.csv>',help='Coverage file to add the <.rtsc> files to, read through its <.npz> sidecar if current')
     settings = parser.add_argument_group('Settings')
     settings.add_argument('-bases',type=str,default='AC',metavar='ACGT',help='[default = AC] Coverage Specificity')
     settings.add_argument('-ot',type=float,default=1.0,help='[default = 1.0] Overlap file threshold')
@@ -65,21 +27,27 @@ def main():
     out_files.add_argument('-on',type=str,metavar='',default=None,help='Overlap file name')
     args = parser.parse_args()
     
+    #Collect Data, adding to an existing coverage file if given
+    if args.update:
+        existing,existing_bases = sfscan.read_coverage(args.update)
+        if existing_bases and existing_bases != args.bases:
+            parser.error('{} was calculated with -bases {}'.format(args.update,existing_bases))
+    coverage_data = collect_coverages(args.f,args.fasta,args.bases)
+    if args.update:
+        coverage_data = sfscan.merge_coverage(existing,coverage_data)
+
     #Generate or assign name
-    default_name = '_'.join(sorted([fyle.replace('.rtsc','') for fyle in args.f])+['coverage'])+'.csv'
+    default_name = '_'.join(sorted(coverage_data.samples)+['coverage'])+'.csv'
     out_name = sfio.check_extension(args.name,'.csv') if args.name else default_name
     
-    #Collect Data
-    coverage_data = collect_coverages(args.f,args.fasta,args.bases)
-    
     #Write Data
-    write_coverage(coverage_data,out_name)
+    sfscan.write_coverage(coverage_data,out_name,args.bases)
     
     #Create overlap file
     if args.ol:
-        default_ol = '_'.join(sorted([fyle.replace('.rtsc','') for fyle in args.f])+['overlap',str(args.ot)])+'.txt'
+        default_ol = '_'.join(sorted(coverage_data.samples)+['overlap',str(args.ot)])+'.txt'
         out_ol = default_ol if args.on == None else sfio.check_extension(args.on,'.txt')
-        write_ol(coverage_data,out_ol,args.ot)
+        sfscan.write_ol(coverage_data,out_ol,args.ot)
 
 if __name__ == '__main__':
     main()
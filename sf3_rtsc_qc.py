@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+'''
+Reads each <.rtsc> once to produce the outputs of sf3_rtsc_coverage, sf3_rtsc_specificity
+and sf3_rtsc_abundances together. Output files are named as those modules name them,
+coverage files add the specificity when several -bases are given.
+'''
+
+#Imports
+import argparse
+import sf3libs.sf3io as sfio
+import sf3libs.sf3scan as sfscan
+
+#Workflow
+def main():
+    parser = argparse.ArgumentParser(description='Calculates coverage, RT stop specificity and abundances from <.rtsc> file(s) in one pass')
+    in_files = parser.add_argument_group('Input')
+    in_files.add_argument('fasta',type=str,metavar='fasta',help='Reference Fasta')
+    in_files.add_argument('rtsc',type=str,help='Input <.rtsc> files',nargs='+')
+    settings = parser.add_argument_group('Settings')
+    settings.add_argument('-bases',type=str,default=['AC'],nargs='+',metavar='ACGT',help='[default = AC] Coverage Specificity, one coverage file each')
+    settings.add_argument('-ot',type=float,default=1.0,help='[default = 1.0] Overlap file threshold')
+    settings.add_argument('-report',default='ACGT',help='Include these nucelotides in the specificity report')
+    settings.add_argument('-round',type=int,default=5,help='[default = 5] Decimal places to report',dest='digits')
+    settings.add_argument('-mode',type=str.upper,default=['RPKM','TPM'],nargs='+',choices=['RPKM','TPM'],help='[default = RPKM TPM] Abundance Metric(s) to Calculate')
+    settings.add_argument('-zero',action='store_true',help='Set missing abundances to zero')
+    out_files = parser.add_argument_group('Output')
+    out_files.add_argument('-ol',action='store_true',help='Create an overlap file per coverage file')
+    args = parser.parse_args()
+
+    #Scan every file once
+    reference = sfscan.ReferenceIndex(sfio.read_fasta(args.fasta),args.bases)
+    scans = sfscan.scan_files(args.rtsc,reference,args.bases)
+    base_name = sorted([sfio.rx_stem(fyle) for fyle in args.rtsc])
+
+    #Coverage and overlap, per specificity
+    for bases in args.bases:
+        coverage_data = sfscan.coverage_matrix(scans,reference,bases)
+        bases_tag = [bases] if len(args.bases) > 1 else []
+        sfscan.write_coverage(coverage_data,'_'.join(base_name+bases_tag+['coverage'])+'.csv',bases)
+        if args.ol:
+            sfscan.write_ol(coverage_data,'_'.join(base_name+bases_tag+['overlap',str(args.ot)])+'.txt',args.ot)
+
+    #Specificity
+    specificity_data = {fyle:letters for fyle,(coverages,letters,totals) in scans.items()}
+    sfscan.write_specificity(specificity_data,'_'.join(base_name+[args.report,'specificity'])+'.csv',args.report,args.digits)
+
+    #Abundances
+    all_totals = {fyle:totals for fyle,(coverages,letters,totals) in scans.items()}
+    blank = 0.0 if args.zero else 'NA'
+    for mode in args.mode:
+        sfscan.write_abundances(sfscan.abundance_table(all_totals,mode),'_'.join(base_name+[mode])+'.csv',mode,blank)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 '''
-This script takes two <.rtsc> along with the base <.fasta> to calculate the reactivity
+This script takes a control and one or more treatment <.rtsc> files along with the base <.fasta> to calculate the reactivity
 scores of each nucelotide of each transcript. If used without a <.scale> file, the script will generate 
 a <.scale> to be used with this script when calculating any additinonal reactvities from other samples that
 are to be compared with the original.
@@ -16,38 +16,139 @@ via options.
 import math
 import argparse
 import os
+import multiprocessing
+import numpy
 import sf3libs.sf3io as sfio
+import sf3libs.sf3scan as sfscan
+import sf3libs.sf3cache as sfcache
+import sf3libs.sf3pool as sfpool
+from sf3libs.sf3sketch import QuantileSketch
 
 #Functions
+def log_stops(stops):
+    '''Natural log of stops+1, looked up from a table of math.log values, rare large counts are computed once each'''
+    stops = numpy.asarray(stops)
+    if not len(stops) or stops.max() < len(LOG_TABLE):
+        return LOG_TABLE[stops]
+    values,inverse = numpy.unique(stops,return_inverse=True)
+    return numpy.array([math.log(value+1,math.e) for value in values.tolist()],dtype=float)[inverse]
+
+def specificity_masks(rtsc_data,transcript_seqs,specificity):
+    '''Specificity masks of the transcripts of an rtsc, covering positions 1 to the end of each stop vector'''
+    return {transcript:sfscan.specificity_mask(transcript_seqs[transcript][:len(stops)-1],specificity)
+            for transcript,stops in rtsc_data.items() if transcript in transcript_seqs}
+
+def normalize_stops(stops,nlog_off=False):
+    '''Logs a stop vector unless nlog_off and scales it to a mean of one, None if it sums to zero'''
+    vector = log_stops(stops) if nlog_off == False else numpy.asarray(stops)
+    total = sum(vector.tolist())
+    return vector.astype(float)/float(total)*len(vector) if total != 0 else None
+
+def normalize_rtsc(rtsc_data,nlog_off=False):
+    '''Normalizes every transcript of an rtsc, dropping those without any stops'''
+    normalized = {}
+    for transcript,stops in rtsc_data.items():
+        vector = normalize_stops(stops,nlog_off)
+        if vector is not None:
+            normalized[transcript] = vector
+    return normalized
+
+def subtract_control(minus_normalized,reagent_plus,nlog_off=False):
+    '''Calculates raw reactivity of a treatment against a control already normalized by normalize_rtsc'''
+    data_out = {}
+    for key,stops in reagent_plus.items():
+        if key in minus_normalized:
+            plus_vector = normalize_stops(stops,nlog_off)
+            if plus_vector is not None:
+                data_out[key] = numpy.maximum(plus_vector-minus_normalized[key],0.0)
+    return data_out
+
 def calculate_raw_reactivity(reagent_minus,reagent_plus,nlog_off=False):
     '''Calculates raw reactivity, with or without the natural log'''
-    key_set,data_out = set(reagent_plus.keys()).intersection(set(reagent_minus.keys())),{}
-    for key in key_set:
-        plus_vector = [math.log(value+1,math.e) for value in reagent_plus[key]] if nlog_off == False else reagent_plus[key]
-        minus_vector = [math.log(value+1,math.e) for value in reagent_minus[key]] if nlog_off == False else reagent_minus[key]
-        sum_plus,sum_minus,length = sum(plus_vector),sum(minus_vector),len(plus_vector)
-        if sum_plus != 0 and sum_minus != 0:
-            nrm_plus_vector = [float(y)/float(sum_plus)*length for y in plus_vector]
-            nrm_minus_vector = [float(z)/float(sum_minus)*length for z in minus_vector]
-            plus_minus = [max(0,a-b) for a, b in zip(nrm_plus_vector,nrm_minus_vector)]
-            data_out[key] = plus_minus
-    return data_out
+    return subtract_control(normalize_rtsc(reagent_minus,nlog_off),reagent_plus,nlog_off)
 
-def generate_normalization_scale(derived_reactivities,transcript_seqs,specificity):
-    '''Generates the 2-8% scale to normalize against'''
+def generate_normalization_scale(derived_reactivities,transcript_seqs,specificity,masks=None):
+    '''Generates the 2-8% scale to normalize against, selecting the band by partition rather than a full sort'''
     data = {}
     for transcript, reactivities in derived_reactivities.items():
-        sequence = transcript_seqs[transcript]
-        accepted = sorted([reactivities[k] for k in range(1,len(reactivities)) if sequence[k-1] in specificity],reverse=True)
-        top = accepted[int(len(accepted)*0.02):int(len(accepted)*0.1)]
-        top_average = sum(top)/len(top) if len(top) > 0 else 0
+        mask = masks[transcript] if masks else sfscan.specificity_mask(transcript_seqs[transcript][:len(reactivities)-1],specificity)
+        accepted = reactivities[1:][mask]
+        size = len(accepted)
+        start,stop = size-int(size*0.1),size-int(size*0.02)
+        if stop > start:
+            band = numpy.partition(accepted,(start,stop-1))[start:stop]
+            top = numpy.sort(band)[::-1].tolist()
+            top_average = sum(top)/len(top)
+        else:
+            top_average = 0
         if top_average > 0:
             data[transcript] = top_average
     return data
 
+def init_band_worker(derived_reactivities,masks):
+    '''Shares one treatment's raw reactivities and masks with a global scale worker'''
+    global worker_band
+    worker_band = derived_reactivities,masks
+
+def sketch_accepted(transcripts,k=4096):
+    '''Sketches the accepted reactivities of some transcripts of the shared treatment'''
+    derived_reactivities,masks = worker_band
+    sketch = QuantileSketch(k)
+    for transcript in transcripts:
+        sketch.update(derived_reactivities[transcript][1:][masks[transcript]])
+    return sketch
+
+def band_counts(transcripts,lower,upper):
+    '''Counts the accepted reactivities of some transcripts at or above upper, and those between lower and upper with their sum'''
+    derived_reactivities,masks = worker_band
+    above,inside,inside_sum = 0,0,0.0
+    for transcript in transcripts:
+        accepted = derived_reactivities[transcript][1:][masks[transcript]]
+        between = accepted[(accepted > lower) & (accepted < upper)]
+        above += int((accepted >= upper).sum())
+        inside,inside_sum = inside+len(between),inside_sum+float(between.sum())
+    return above,inside,inside_sum
+
+def global_normalization_scale(derived_reactivities,transcript_seqs,specificity,masks=None,k=4096,workers=1):
+    '''Generates a transcriptome wide 2-8% scale, the same value for every transcript.
+    A quantile sketch (sf3sketch) finds the edges of the band, which is then averaged exactly in a second pass,
+    values past a misplaced edge count as the edge itself. Transcript chunks are sketched by workers and merged'''
+    masks = masks if masks else specificity_masks(derived_reactivities,transcript_seqs,specificity)
+    transcripts = list(derived_reactivities.keys())
+    chunks = [transcripts[i::max(workers,1)] for i in range(max(workers,1))]
+    if workers > 1 and len(transcripts) > 1:
+        with multiprocessing.Pool(workers,initializer=init_band_worker,initargs=(derived_reactivities,masks)) as pool:
+            sketches = pool.starmap(sketch_accepted,[(chunk,k) for chunk in chunks])
+            sketch = sketches[0]
+            for other in sketches[1:]:
+                sketch.merge(other)
+            if not sketch.n:
+                return {}
+            lower,upper = sketch.quantile(0.9),sketch.quantile(0.98)
+            counts = pool.starmap(band_counts,[(chunk,lower,upper) for chunk in chunks])
+    else:
+        init_band_worker(derived_reactivities,masks)
+        sketch = sketch_accepted(transcripts,k)
+        if not sketch.n:
+            return {}
+        lower,upper = sketch.quantile(0.9),sketch.quantile(0.98)
+        counts = [band_counts(transcripts,lower,upper)]
+    above,inside,inside_sum = [sum(column) for column in zip(*counts)]
+
+    #Walk the descending order, values at or above upper count as upper, between at their mean, the rest as lower
+    start,stop = int(sketch.n*0.02),int(sketch.n*0.1)
+    groups = [(above,upper),(inside,inside_sum/inside if inside else 0),(sketch.n,lower)]
+    total,position = 0.0,0
+    for count,value in groups:
+        overlap = max(0,min(stop,position+count)-max(start,position))
+        total += overlap*value
+        position += count
+    top_average = total/(stop-start) if stop > start else 0
+    return {transcript:top_average for transcript in transcripts} if top_average > 0 else {}
+
 def write_norm_scale(scale_dictionary,outfile):
     '''Writes out a normalization scale file'''
-    with open(outfile,'w') as g:
+    with sfio.open_text(outfile,'w') as g:
         g.write(','.join(['transcript','value'])+'\n')
         for transcript, value in sorted(scale_dictionary.items()):
             g.write(','.join([transcript,str(value)])+'\n')
@@ -55,7 +156,7 @@ def write_norm_scale(scale_dictionary,outfile):
 def read_norm_scale(normalization_file):
     '''Reads in a normalization scale file'''
     info = {}
-    with open(normalization_file, 'r') as f:
+    with sfio.open_text(normalization_file) as f:
         for line in f:
             if line.startswith('transcript'):
                 continue
@@ -64,73 +165,181 @@ def read_norm_scale(normalization_file):
                 info[transcript] = float(value)
     return info
 
-def calculate_final_reactivity(derived_reactivities,sequences,specificity,threshold,nrm_scale,norm_off=False):
-    '''Calculates the final reactivity'''
+def round_thousandths(values):
+    '''Rounds an array as float('%.3f'%x) does, formatting only values too close to a tie to settle by arithmetic'''
+    scaled = values*1000
+    floor = numpy.floor(scaled)
+    fraction = scaled-floor
+    rounded = (floor+(fraction > 0.5))/1000
+    unsure = (numpy.abs(fraction-0.5) <= 1e-6) | numpy.signbit(scaled) | ~(scaled < 2**30)
+    for i in numpy.flatnonzero(unsure).tolist():
+        rounded[i] = float('%.3f'%values[i])
+    return rounded
+
+def calculate_final_reactivity(derived_reactivities,sequences,specificity,threshold,nrm_scale,norm_off=False,masks=None):
+    '''Calculates the final reactivity, as float arrays with NaN where NA'''
     data_out,missing_transcripts = {},{}
     for transcript, reactivities in derived_reactivities.items():
         if transcript in nrm_scale:
             normalizer = nrm_scale[transcript] if norm_off == False else 1
-            seq = sequences[transcript]
-            normalized_values =[str(float('%.3f'%min((reactivities[x]/normalizer), threshold))) if seq[x-1] in specificity else 'NA' for x in range(1,len(reactivities))]+['NA']
+            mask = masks[transcript] if masks else sfscan.specificity_mask(sequences[transcript][:len(reactivities)-1],specificity)
+            normalized_values = numpy.full(max(len(reactivities),1),numpy.nan)
+            capped = numpy.minimum(reactivities[1:]/normalizer,threshold)
+            normalized_values[:len(capped)][mask] = round_thousandths(capped[mask])
             data_out[transcript] = normalized_values
         else:
             missing_transcripts[transcript] = None
     return data_out,missing_transcripts
 
+def react_name(control,treatment,setting,name=None,sweep=False,global_scale=False):
+    '''Names the <.react> of a control/treatment pair and (ln_off,nrm_off,bases,threshold) setting, sweeps tag bases and threshold too'''
+    ln_off,nrm_off,bases,threshold = setting
+    if name and not sweep:
+        return sfio.check_extension(name,'.react')
+    log_tag = ['ln'] if ln_off == False else []
+    nrm_tag = (['gnrm'] if global_scale else ['nrm']) if nrm_off == False else []
+    sweep_tag = [bases,'t'+str(threshold)] if sweep else []
+    if name:
+        return sfio.tag_name(name,'.react','_'.join(log_tag+nrm_tag+sweep_tag))
+    stem = '_'.join([sfio.rx_stem(x.split(os.sep)[-1]) for x in [control,treatment]])
+    return '_'.join([stem]+log_tag+nrm_tag+sweep_tag)+'.react'
+
+def stage_keys(digests,ln_offs,bases_list,global_scale=False,sketch_size=4096,sketch_workers=1):
+    '''Cache keys of a treatment's raw reactivity per log setting and scale per log setting and specificity.
+    digests are those of the control, treatment, fasta and restricted names. Each stage lists the key of an
+    unrestricted run ahead of the key of the run as restricted, a global scale cannot be cut down so only has the latter'''
+    control,treatment,fasta,restrict = digests
+    runs = [None,restrict] if restrict else [None]
+    raw = {ln_off:[sfcache.stage_key('raw',control,treatment,ln_off,run) for run in runs] for ln_off in ln_offs}
+    scale_runs,sketch = ([restrict],(sketch_size,sketch_workers)) if global_scale else (runs,None)
+    scales = {(ln_off,bases):[sfcache.stage_key('scale',control,treatment,fasta,ln_off,run,bases,sketch) for run in scale_runs]
+              for ln_off in ln_offs for bases in bases_list}
+    return raw,scales
+
+def load_stage(stage_cache,keys,covered):
+    '''First readable cached entry of keys cut down to the covered transcripts, None without a cache or an entry'''
+    for key in (keys if stage_cache else []):
+        data = stage_cache.load(key)
+        if data is not None:
+            return sfio.restrict_keys(data,covered)
+    return None
+
+def react_treatment(treatment,out_names,covered,nrm_scale,settings,save_fails=False,global_scale=False,sketch_size=4096,sketch_workers=1,
+                    cache_dir=None,cache_size=0,cache_keys=None):
+    '''Calculates one treatment against the shared control for each (ln_off,nrm_off,bases,threshold) setting.
+    Raw reactivity is computed once per log setting and the scale once per log setting and specificity.
+    If global_scale, the scale is the transcriptome wide 2-8% of a quantile sketch of sketch_size.
+    If given cache_dir, both stages are looked up by their stage_keys first and stored there once computed,
+    the control and treatment are only read when a stage is missing'''
+    control,controls,seqs,masks = sfpool.shared()
+    stage_cache = sfcache.StageCache(cache_dir,cache_size) if cache_dir else None
+    raw_keys,scale_keys = cache_keys if cache_keys else ({},{})
+    treatment_data,masks = None,dict(masks)
+    raw,scales,writing = {},{},None
+    for (ln_off,nrm_off,bases,threshold),out_name in zip(settings,out_names):
+        if ln_off not in raw:
+            raw[ln_off] = load_stage(stage_cache,raw_keys.get(ln_off),covered)
+            if raw[ln_off] is None:
+                if ln_off not in controls:
+                    controls[ln_off] = normalize_rtsc(sfio.read_rtsc(control,covered,as_array=True),ln_off)
+                if treatment_data is None:
+                    treatment_data = sfio.read_rtsc(treatment,covered,as_array=True)
+                raw[ln_off] = subtract_control(controls[ln_off],treatment_data,ln_off)
+                if stage_cache:
+                    stage_cache.store(raw_keys[ln_off][-1],raw[ln_off])
+        data = raw[ln_off]
+        if bases not in masks:
+            masks[bases] = specificity_masks(data,seqs,bases)
+
+        #Generate and write scale, unless a <.scale> file was read in
+        if nrm_scale == None:
+            if (ln_off,bases) not in scales:
+                cached = load_stage(stage_cache,scale_keys.get((ln_off,bases)),covered)
+                if cached is not None:
+                    scales[(ln_off,bases)] = {transcript:float(value[0]) for transcript,value in cached.items()}
+                elif global_scale:
+                    scales[(ln_off,bases)] = global_normalization_scale(data,seqs,bases,masks[bases],sketch_size,sketch_workers)
+                else:
+                    scales[(ln_off,bases)] = generate_normalization_scale(data,seqs,bases,masks[bases])
+                if stage_cache and cached is None:
+                    stage_cache.store(scale_keys[(ln_off,bases)][-1],{t:[value] for t,value in scales[(ln_off,bases)].items()})
+            write_norm_scale(scales[(ln_off,bases)],out_name.replace('.react','.scale'))
+        scale = nrm_scale if nrm_scale != None else scales[(ln_off,bases)]
+
+        #Calculate Final Reactivity
+        out_reactivity,out_missing = calculate_final_reactivity(data,seqs,bases,threshold,scale,nrm_off,masks[bases])
+
+        #Write Out, one file in flight at a time, and the Fails
+        if writing:
+            writing.result()
+        writing = sfio.write_react(out_reactivity,out_name,sort_flag=True,background=True)
+        if save_fails:
+            sfio.write_keys(out_missing,out_name.replace('.react','_unresolvable_transcripts.txt'))
+    writing.result()
+    return out_names
+
 def main():
-    parser = argparse.ArgumentParser(description='Generates a <.react> file from two <.rtsc> files')
+    parser = argparse.ArgumentParser(description='Generates <.react> files from a control and one or more treatment <.rtsc> files')
     in_files = parser.add_argument_group('Input')
     in_files.add_argument('control',type=str,help='Control <.rtsc> file')
-    in_files.add_argument('treatment',type=str,help='Reagent <.rtsc> file')
+    in_files.add_argument('treatment',type=str,nargs='+',help='Reagent <.rtsc> file(s), each is compared against the control')
     in_files.add_argument('fasta',type=str,help='Transcript <.fasta> file')
     settings = parser.add_argument_group('Settings')
     settings.add_argument('-restrict',default = None,metavar='<.txt>',help='Limit analysis to these specific transcripts')
     settings.add_argument('-scale',type=str,default= None,metavar='<.scale>',help='Provide a normalizaiton file for calculation')
-    settings.add_argument('-threshold',type=float,default=7.0,help='[default = 7.0] Maximum Reactivity Cap')
+    settings.add_argument('-threshold',type=float,default=[7.0],nargs='+',help='[default = 7.0] Maximum Reactivity Cap, several values sweep')
     settings.add_argument('-ln_off',action='store_true', help='Do not take the natural log of the stop counts')
     settings.add_argument('-nrm_off',action='store_true',help='Do not perform final 2-8'+u"\uFF05"+' reactivity normalization')
-    settings.add_argument('-bases',type=str,default = 'AC',metavar='ACGT',help='[default = AC] Reaction Specificity')
+    settings.add_argument('-bases',type=str,default = ['AC'],nargs='+',metavar='ACGT',help='[default = AC] Reaction Specificity, several values sweep')
+    settings.add_argument('-global_scale',action='store_true',default=False,help='Normalize by the transcriptome wide 2-8'+u"\uFF05"+' instead of per transcript')
+    settings.add_argument('-sketch_size',type=int,default=4096,metavar='<number>',help='[default = 4096] Quantile sketch capacity k of -global_scale, rank error <= n(log2(n/k)+1)/k')
+    settings.add_argument('-sweep_ln',action='store_true',default=False,help='Sweep both with and without -ln_off')
+    settings.add_argument('-sweep_nrm',action='store_true',default=False,help='Sweep both with and without -nrm_off')
+    settings.add_argument('-cache_dir',type=str,default=None,metavar='<dir>',help='Keep raw reactivities and scales here, reused while inputs and settings match')
+    settings.add_argument('-cache_size',type=int,default=4096,metavar='<number>',help='[default = 4096] Megabytes -cache_dir may hold, least recently used entries are removed')
+    settings.add_argument('-workers',type=int,default=1,metavar='<number>',help='[default = 1] Number of worker processes for the treatments')
     out_files = parser.add_argument_group('Output')
     out_files.add_argument('-save_fails',action='store_true',help='Log transcripts with zero or missing scales')
-    out_files.add_argument('-name',type=str,default = None, help='Specify output file name')
+    out_files.add_argument('-name',type=str,default = None, help='Specify output file name, single treatment only')
     args = parser.parse_args()
-    
-    #Create output name
-    base_tag = [x.split(os.sep)[-1].replace('.rtsc','') for x in [args.control,args.treatment]]
-    log_tag = ['ln'] if args.ln_off == False else []
-    nrm_tag = ['nrm'] if args.ln_off == False else []
-    base_name = '_'.join(base_tag+log_tag+nrm_tag)
-    out_name = base_name+'.react' if args.name == None else sfio.check_extension(args.name,'.react')
-
-    #Read in data
-    control_data,treatment_data = map(sfio.read_rtsc,[args.control,args.treatment])
-
-    #Apply filter if enabled
-    if args.restrict:
-        covered = sfio.read_restrict(args.restrict)
-        control_data = {n:s for n,s in control_data.items() if n in covered}
-        treatment_data = {n:s for n,s in treatment_data.items() if n in covered}
-
-    #Calculate Derived Reactivity
-    data = calculate_raw_reactivity(control_data,treatment_data,args.ln_off)
-    
-    #Read in transcript sequences
+    if args.name and len(args.treatment) > 1:
+        parser.error('-name can only be used with a single treatment')
+
+    #Generate the (ln_off,nrm_off,bases,threshold) settings
+    ln_offs = [False,True] if args.sweep_ln else [args.ln_off]
+    nrm_offs = [False,True] if args.sweep_nrm else [args.nrm_off]
+    settings = [(ln_off,nrm_off,bases,threshold) for ln_off in ln_offs for nrm_off in nrm_offs for bases in args.bases for threshold in args.threshold]
+    sweep = len(settings) > 1
+    sketch_workers = args.workers if len(args.treatment) == 1 else 1
+
+    #Key the cached stages of each treatment by the contents of its inputs
+    covered = sfio.read_restrict(args.restrict) if args.restrict else None
+    cache_size,cache_keys,cached = args.cache_size*2**20,{},False
+    if args.cache_dir:
+        stage_cache = sfcache.StageCache(args.cache_dir,cache_size)
+        shared = [sfcache.file_digest(args.control),sfcache.file_digest(args.fasta),sfcache.names_digest(covered)]
+        for treatment in args.treatment:
+            digests = [shared[0],sfcache.file_digest(treatment)]+shared[1:]
+            cache_keys[treatment] = stage_keys(digests,ln_offs,args.bases,args.global_scale,args.sketch_size,sketch_workers)
+        cached = all(any(map(stage_cache.has,keys)) for raw_keys,scale_keys in cache_keys.values() for keys in raw_keys.values())
+
+    #Read in the control and sequences once, limited to the restricted transcripts if enabled, the control only if a raw stage is missing
+    controls,masks = {},{}
     seqs = sfio.read_fasta(args.fasta)
-    
-    #Generate and write scale, or read a <.scale> file in
-    normalizaiton_scale = generate_normalization_scale(data,seqs,args.bases) if args.scale == None else read_norm_scale(args.scale)
-    if args.scale == None:
-        write_norm_scale(normalizaiton_scale,out_name.replace('.react','.scale'))
-    
-    #Calculate Final Reactivity
-    out_reactivity,out_missing = calculate_final_reactivity(data,seqs,args.bases,args.threshold,normalizaiton_scale,args.nrm_off)
-    
-    #Write Out
-    sfio.write_react(out_reactivity,out_name,sort_flag=True)
-
-    #Write Out Fails
-    if args.save_fails:
-        sfio.write_keys(out_missing,out_name.replace('.react','_unresolvable_transcripts.txt'))
+    if not cached:
+        control_data = sfio.read_rtsc(args.control,covered,as_array=True)
+        controls = {ln_off:normalize_rtsc(control_data,ln_off) for ln_off in ln_offs}
+        masks = {bases:specificity_masks(controls[ln_offs[0]],seqs,bases) for bases in args.bases}
+    normalizaiton_scale = read_norm_scale(args.scale) if args.scale else None
+
+    #Calculate each treatment against the shared control
+    jobs = [(treatment,[react_name(args.control,treatment,setting,args.name,sweep,args.global_scale) for setting in settings],
+             covered,normalizaiton_scale,settings,args.save_fails,args.global_scale,args.sketch_size,sketch_workers,
+             args.cache_dir,cache_size,cache_keys.get(treatment)) for treatment in args.treatment]
+    sfpool.run_jobs(react_treatment,jobs,(args.control,controls,seqs,masks),args.workers)
+
+#Variables
+LOG_TABLE = numpy.array([math.log(value+1,math.e) for value in range(65536)],dtype=float)
 
 if __name__ == '__main__':
     main()
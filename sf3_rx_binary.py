@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+'''
+Converts <.rtsc>/<.react> files into binary, memory mappable containers and back.
+Binary <.rtsc> are written as <.brtsc> (int32 stops), binary <.react> as <.breact> 
+(float32 reactivities, NA stored as NaN). Binary files may be used anywhere the text 
+versions are read, and name outputs as the text versions would. Converting back 
+reproduces the text file, provided reactivities carry no more precision than float32 
+holds, which is the case for <.react> written by sf3_rtsc_to_react.
+'''
+
+#Imports
+import argparse
+import sf3libs.sf3io as sfio
+import sf3libs.sf3bin as sfbin
+
+#Functions
+def text_to_binary(fyle,out_name=None):
+    '''Converts a text <.rtsc>/<.react> to a binary container, returns the new name'''
+    kind = 'rtsc' if fyle.endswith('.rtsc') else 'react'
+    readers = {'rtsc':sfio.read_rtsc,'react':sfio.read_react}
+    out_name = out_name if out_name else sfio.rm_ext(fyle,'.'+kind)+'.b'+kind
+    sfbin.write_rx_binary(readers[kind](fyle),out_name,kind)
+    return out_name
+
+def binary_to_text(fyle,out_name=None):
+    '''Converts a binary container to a text <.rtsc>/<.react>, returns the new name'''
+    kind,data = sfbin.read_rx_binary(fyle)
+    writers = {'rtsc':sfio.write_rtsc,'react':sfio.write_react}
+    out_name = out_name if out_name else sfio.rm_ext(fyle,'.b'+kind)+'.'+kind
+    writers[kind]({k:sfbin.rx_to_text(v,kind) for k,v in data.items()},out_name)
+    return out_name
+
+#Workflow
+def main():
+    parser = argparse.ArgumentParser(description='Converts <.rtsc>/<.react> to and from binary containers')
+    in_files = parser.add_argument_group('Input')
+    in_files.add_argument('rx',help='Input <.rtsc>/<.react>/<.brtsc>/<.breact> files',nargs='+')
+    out_files = parser.add_argument_group('Output')
+    out_files.add_argument('-name',default=None,help='Specify output file name (single input only)')
+    args = parser.parse_args()
+    if args.name and len(args.rx) > 1:
+        parser.error('-name only takes a single input')
+
+    #Convert each file in the direction it needs
+    for fyle in args.rx:
+        if sfbin.is_rx_binary(fyle):
+            binary_to_text(fyle,args.name)
+        elif fyle.endswith(('.rtsc','.react')):
+            text_to_binary(fyle,args.name)
+        else:
+            print('Skipping {}, not a <.rtsc>/<.react> file'.format(fyle))
+
+if __name__ == '__main__':
+    main()
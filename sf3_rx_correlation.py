@@ -1,7 +1,10 @@
 #!/usr/bin/env python3 
 
 '''
-Reformats either <.rtsc> or <.react> files for correlation analysis.
+Calculates the pairwise Pearson and Spearman correlations of <.rtsc> or <.react> files,
+transcriptome wide as a sample by sample matrix and per transcript as a table. Positions
+are compared where every file has a value, a transcript missing from a file has none.
+With -long, the data is also reformatted one row per position for outside analysis.
 Using a coverage overlap file or any other list of specific transcripts
 will truncate the output only to those transcripts. By default, 
 this reports all bases for both file types, requiring an acompanying 
@@ -19,17 +22,47 @@ in the fasta, the input would be ACac.
 
 #Imports
 import argparse
+import numpy
 import sf3libs.sf3io as sfio
+import sf3libs.sf3scan as sfscan
+
+#Classes
+class CorrelationSums(object):
+    '''Sufficient statistics of the pairwise Pearson correlation of columns, added to a block of rows at a time'''
+    def __init__(self,width):
+        self.n,self.sums,self.products = 0,numpy.zeros(width),numpy.zeros((width,width))
+
+    def add(self,block):
+        '''Adds a positions x samples block without missing values'''
+        self.n += len(block)
+        self.sums += block.sum(axis=0)
+        self.products += block.T @ block
+
+    def pearson(self):
+        '''Samples x samples Pearson correlation, NaN where a sample does not vary or there are fewer than 2 rows'''
+        if self.n < 2:
+            return numpy.full(self.products.shape,numpy.nan)
+        centered = self.products-numpy.outer(self.sums,self.sums)/self.n
+        spread = numpy.sqrt(numpy.maximum(numpy.diag(centered),0))
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            correlation = centered/numpy.outer(spread,spread)
+        numpy.fill_diagonal(correlation,1.0)
+        correlation[(spread == 0)[:,None] | (spread == 0)[None,:]] = numpy.nan
+        return numpy.clip(correlation,-1,1)
 
 #Functions
+def text_values(values):
+   '''Values as written to the long format, arrays become lists with NaN as NA'''
+   return ['NA' if x != x else x for x in values.tolist()] if hasattr(values,'tolist') else values
+
 def write_react_repeatability(react_data,sequences,out_fyle,specificity='ACGT'):
    '''Writes out react correlation data.'''
    all_keys = sorted(set.union(*map(set,react_data.values())))
    header=','.join(['transcript','position','base']+all_keys)
-   with open(out_fyle,'w') as g:
+   with sfio.open_text(out_fyle,'w') as g:
        g.write(header+'\n')
        for transcript, data in react_data.items():
-           temp_data = [data.get(key,'NA'*len(sequences[transcript])) for key in all_keys]
+           temp_data = [text_values(data.get(key,['NA']*len(sequences[transcript]))) for key in all_keys]
            for pos, base in enumerate(sequences[transcript],1):
                if base in specificity:
                    info_cols = [transcript,str(pos),base]
@@ -40,19 +73,96 @@ def write_rtsc_repeatability(rtsc_data,sequences,out_fyle,specificity='ACGT'):
    '''Writes out the rtsc correlation data. The offset (1) is built in'''
    all_keys = sorted(set.union(*map(set,rtsc_data.values())))
    header=','.join(['transcript','position','base']+all_keys)
-   with open(out_fyle,'w') as g:
+   with sfio.open_text(out_fyle,'w') as g:
        g.write(header+'\n')
        for transcript, data in rtsc_data.items():
-           temp_data = [data.get(key,'NA'*len(sequences[transcript]))[1:] for key in all_keys]
+           temp_data = [text_values(data.get(key,['NA']*len(sequences[transcript])))[1:] for key in all_keys]
            for pos, base in enumerate(sequences[transcript][:-1],1):
                if base in specificity:
                    info_cols = [transcript,str(pos),base]
                    data_cols = [str(values[pos-1]) for values in temp_data]
                    g.write(','.join(info_cols+data_cols)+'\n')
 
+def aligned_values(sample_values,samples,sequence,specificity,kind):
+    '''Positions x samples array of one transcript at the specific bases, <.rtsc> stops offset by one, NaN where missing'''
+    sequence = sequence[:-1] if kind == 'rtsc' else sequence
+    offset = 1 if kind == 'rtsc' else 0
+    mask = sfscan.specificity_mask(sequence,specificity)
+    block = numpy.full((len(sequence),len(samples)),numpy.nan)
+    for column,sample in enumerate(samples):
+        if sample in sample_values:
+            values = numpy.asarray(sample_values[sample][offset:offset+len(sequence)],dtype=float)
+            block[:len(values),column] = values
+    return block[mask]
+
+def complete_rows(block):
+    '''Rows of a block with a value in every column'''
+    return block[~numpy.isnan(block).any(axis=1)]
+
+def midranks(values):
+    '''Ranks from 1 of a vector, ties share their average rank'''
+    distinct,inverse,counts = numpy.unique(values,return_inverse=True,return_counts=True)
+    return (numpy.cumsum(counts)-(counts-1)/2.0)[inverse]
+
+def rank_table(distinct,counts):
+    '''Sorted distinct values and the midranks they take among all counted values'''
+    return distinct,numpy.cumsum(counts)-(counts-1)/2.0
+
+def merge_counts(pieces):
+    '''Merges (distinct values,counts) pieces into one sorted histogram'''
+    if not pieces:
+        return numpy.zeros(0),numpy.zeros(0)
+    distinct,inverse = numpy.unique(numpy.concatenate([values for values,counts in pieces]),return_inverse=True)
+    return distinct,numpy.bincount(inverse,weights=numpy.concatenate([counts for values,counts in pieces]))
+
+def correlate(rx_data,sequences,samples,specificity,kind):
+    '''Pearson and Spearman correlations of samples, transcriptome wide {method:matrix} and per transcript
+    {transcript:(positions,pearson matrix,spearman matrix)}. Pearson sums and value histograms build up transcript by
+    transcript, a second pass ranks each value against its sample's histogram for the transcriptome wide Spearman'''
+    overall,per_transcript,histograms = CorrelationSums(len(samples)),{},[[] for sample in samples]
+    for transcript in sorted(rx_data):
+        block = complete_rows(aligned_values(rx_data[transcript],samples,sequences[transcript],specificity,kind))
+        overall.add(block)
+        pearson,ranked = CorrelationSums(len(samples)),CorrelationSums(len(samples))
+        pearson.add(block)
+        if len(block):
+            ranked.add(numpy.column_stack([midranks(column) for column in block.T]))
+            for column,pieces in zip(block.T,histograms):
+                pieces.append(numpy.unique(column,return_counts=True))
+        per_transcript[transcript] = (len(block),pearson.pearson(),ranked.pearson())
+    tables = [rank_table(*merge_counts(pieces)) for pieces in histograms]
+    ranked = CorrelationSums(len(samples))
+    for transcript in sorted(rx_data):
+        block = complete_rows(aligned_values(rx_data[transcript],samples,sequences[transcript],specificity,kind))
+        if len(block):
+            ranked.add(numpy.column_stack([ranks[numpy.searchsorted(distinct,column)] for (distinct,ranks),column in zip(tables,block.T)]))
+    return {'pearson':overall.pearson(),'spearman':ranked.pearson()},per_transcript
+
+def format_r(value):
+    '''Correlation as text, NA if undefined'''
+    return 'NA' if numpy.isnan(value) else str(float(value))
+
+def write_correlation_matrix(matrices,samples,out_fyle):
+    '''Writes the transcriptome wide sample x sample matrices, one block of rows per method'''
+    with sfio.open_text(out_fyle,'w') as g:
+        g.write(','.join(['method','sample']+samples)+'\n')
+        for method,matrix in sorted(matrices.items()):
+            for sample,row in zip(samples,matrix):
+                g.write(','.join([method,sample]+[format_r(value) for value in row])+'\n')
+
+def write_transcript_correlations(per_transcript,samples,out_fyle):
+    '''Writes the positions compared and each pairwise correlation per transcript'''
+    pairs = [(i,j) for i in range(len(samples)) for j in range(i+1,len(samples))]
+    header = ['transcript','positions']+['_'.join([method,samples[i],samples[j]]) for method in ['pearson','spearman'] for i,j in pairs]
+    with sfio.open_text(out_fyle,'w') as g:
+        g.write(','.join(header)+'\n')
+        for transcript,(positions,pearson,spearman) in sorted(per_transcript.items()):
+            values = [format_r(matrix[i,j]) for matrix in [pearson,spearman] for i,j in pairs]
+            g.write(','.join([transcript,str(positions)]+values)+'\n')
+
 #Workflow
 def main():
-    parser = argparse.ArgumentParser(description='Reformats <.rtsc>/<.react> for easy correlation analysis')
+    parser = argparse.ArgumentParser(description='Calculates <.rtsc>/<.react> correlations, optionally reformatting them for outside analysis')
     in_files = parser.add_argument_group('Input')
     in_files.add_argument('fasta',help='Reference Fasta')
     in_files.add_argument('rx',help='Input <.rx> files',nargs='+')
@@ -61,41 +171,43 @@ def main():
     settings.add_argument('-bases',default='AGCT',metavar='ACGT',help='[default = ACGT] Nucleotide specifictiy')
     settings.add_argument('-restrict',default=None,metavar='<.txt>',help='Filter to these transcripts via coverage file')
     out_files = parser.add_argument_group('Output')
+    out_files.add_argument('-long',action='store_true',help='Also write the one row per position <.csv>')
     out_files.add_argument('-name',default=None,help='Specify output file name')
     args = parser.parse_args()
 
     #Set up
     covered = sfio.read_restrict(args.restrict) if args.restrict else None
     fasta_dict = sfio.read_fasta(args.fasta)
-    desc = [sfio.rm_ext(x,'.rtsc','.react') for x in args.rx]
-
-    #All files are <.rtsc>
-    if all(fyle.split('.')[-1] == 'rtsc' for fyle in args.rx):
-        rx_data = sfio.read_rx_files(args.rx,mode='rtsc',verbose=args.verbose)
-        default_name = '_'.join(desc+['rtsc']+['correlation.csv'])
-        out_name = sfio.check_extension(args.name,'.csv') if args.name else default_name
-        if args.restrict:
-            rx_data = {n:s for n,s in rx_data.items() if n in covered}
-        if args.verbose:
-            print('Remaining after filtering',len(rx_data),sep=',')
-            print('Writing File:',out_name,sep=',')
-        write_rtsc_repeatability(rx_data,fasta_dict,out_name,args.bases)
-
-    #All files are <.react>
-    elif all(fyle.split('.')[-1] == 'react' for fyle in args.rx):
-        rx_data = sfio.read_rx_files(args.rx,mode='react',verbose=args.verbose)
-        default_name = '_'.join(desc+['react']+['correlation.csv'])
-        out_name = sfio.check_extension(args.name,'.csv') if args.name else default_name
-        if args.restrict:
-            rx_data = {n:s for n,s in rx_data.items() if n in covered}
-        if args.verbose:
-            print('Remaining after filtering',len(rx_data),sep=',')
-            print('Writing File:',out_name,sep=',')
-        write_react_repeatability(rx_data,fasta_dict,out_name,args.bases)
+    desc = [sfio.rx_stem(x) for x in args.rx]
+    kinds = {sfio.rx_kind(fyle) for fyle in args.rx}
 
     #Files do not make sense
-    else:
+    if len(kinds) != 1 or not kinds <= {'rtsc','react'}:
         print('All Files must be the same type, and either .rtsc or .react!')
+        return
+    kind = kinds.pop()
+
+    #Read in, the long file is named as before, the matrix and transcript tables after it
+    rx_data = sfio.read_rx_files(args.rx,mode=kind,verbose=args.verbose,restrict=covered,as_array=True)
+    default_name = '_'.join(desc+[kind]+['correlation.csv'])
+    out_name = sfio.check_extension(args.name,'.csv') if args.name else default_name
+    samples = sorted(set().union(*map(set,rx_data.values())))
+    if args.verbose:
+        print('Remaining after filtering',len(rx_data),sep=',')
+
+    #Correlations
+    matrices,per_transcript = correlate(rx_data,fasta_dict,samples,args.bases,kind)
+    write_correlation_matrix(matrices,samples,sfio.rm_ext(out_name,'.csv')+'_matrix.csv')
+    write_transcript_correlations(per_transcript,samples,sfio.rm_ext(out_name,'.csv')+'_transcripts.csv')
+
+    #Long format
+    if args.long:
+        if args.verbose:
+            print('Writing File:',out_name,sep=',')
+        if kind == 'rtsc':
+            write_rtsc_repeatability(rx_data,fasta_dict,out_name,args.bases)
+        else:
+            write_react_repeatability(rx_data,fasta_dict,out_name,args.bases)
 
 if __name__ == '__main__':
     main()
@@ -1,51 +1,252 @@
 #!/usr/bin/env python3
 
 #Imports
+import os
+import sys
 import argparse
+import numpy
 import sf3libs.sf3io as sfio
 import sf3libs.sf3sam as sf3sam
+import sf3libs.sf3bam as sf3bam
+import sf3libs.sf3bin as sf3bin
+import sf3libs.sf3pool as sfpool
 from collections import Counter
 
 #Functions
-def sam_to_rtsc(in_sam,seq_lims,mm,fst,keyflag):
-    '''Takes a SAM file and writes it as an rtsc file, returns log'''
-    #Read in SAM, gather passing stops and metrics
-    report,stops,rtsc = Counter(),{},{}
-    with open(in_sam,'r') as f:
-        for line in f:
-            if line.startswith('@'):
-                continue
+def read_alignments(in_sam,threads=4):
+    '''Yields parsed alignments from SAM, <.sam.gz>, <.bam>, a named pipe or '-' for stdin'''
+    if in_sam == '-':
+        return sf3sam.parse_sam(sys.stdin)
+    elif in_sam.endswith('.bam'):
+        return sf3bam.read_bam(in_sam,threads)
+    elif in_sam.endswith('.gz'):
+        return sf3sam.parse_sam(sf3bam.gzip_lines(in_sam,threads))
+    else:
+        return sf3sam.parse_sam(open_lines(in_sam))
+
+def open_lines(fyle):
+    '''Yields the lines of a text file, closing it when done'''
+    with open(fyle,'r') as f:
+        yield from f
+
+def stop_layout(seq_lims):
+    '''Lays transcripts out in one contiguous stop buffer, returns {name:(offset,limit)} and the buffer size'''
+    layout,total = {},0
+    for seq,limit in seq_lims.items():
+        layout[seq] = (total,limit)
+        total += limit
+    return layout,total
+
+def filter_reads(reads,seq_lims,settings,batch_size=65536):
+    '''Filters parsed alignments under each (mismatches,firstmm,keyflag) setting in one pass,
+    returns a filter report per setting and a stop buffer row per setting laid out by stop_layout'''
+    layout,total = stop_layout(seq_lims)
+    reports = [Counter() for setting in settings]
+    stops,batch = numpy.zeros((len(settings),total),dtype=numpy.int32),[]
+    failed_keys = {(False,True):'mismatches',(True,False):'firstbase',(False,False):'firstbase_and_mismatches'}
+    for flag,rname,position,mismatches,first in reads:
+        offset,limit = layout.get(rname,(0,0))
+        index = offset+position-1 if 0 < position <= limit else None
+        for row,(mm,fst,keyflag) in enumerate(settings):
+            if flag & keyflag:
+                reports[row]['bitflag']+=1
             else:
-                item = sf3sam.MappedRead(line)
-                if item.pass_bitflag(keyflag):
-                    tests = {'mismatches':item.pass_mismatches(mm),
-                             'firstbase':item.pass_first(fst)}
-                    if all(tests.values()):
-                        report['passing']+=1
-                        stops.setdefault(item.rname,Counter())[int(item.position)-1]+=1
-                    else:
-                        failed_tests = sorted([k for k,v in tests.items() if not v])
-                        failed_key = '_and_'.join(failed_tests)
-                        report[failed_key]+=1
+                tests = (mismatches <= mm,fst or not first)
+                if tests == (True,True):
+                    reports[row]['passing']+=1
+                    if index is not None:
+                        batch.append(row*total+index)
                 else:
-                    report['bitflag']+=1
-    #Reorganize the stops
-    for seq,limit in seq_lims.items():
-        if seq in stops:
-            rtsc[seq] = [str(stops[seq][index]) for index in range(0,limit)]
+                    reports[row][failed_keys[tests]]+=1
+        if len(batch) >= batch_size:
+            numpy.add.at(stops.reshape(-1),batch,1)
+            batch = []
+    numpy.add.at(stops.reshape(-1),batch,1)
+    return reports,stops
+
+def reads_to_records(reads,seq_lims,chunk_size=1048576):
+    '''Yields chunks of sf3bin.STOP_DTYPE records from parsed alignments, transcripts indexed as in seq_lims'''
+    index,chunk = {name:i for i,name in enumerate(seq_lims)},[]
+    for flag,rname,position,mismatches,first in reads:
+        chunk.append((index.get(rname,-1),position-1,flag,mismatches,first))
+        if len(chunk) >= chunk_size:
+            yield numpy.array(chunk,dtype=sf3bin.STOP_DTYPE)
+            chunk = []
+    yield numpy.array(chunk,dtype=sf3bin.STOP_DTYPE)
+
+def add_stops(row,flat):
+    '''Adds one stop per flat index, with a local bincount when the indices are clustered'''
+    if len(flat) == 0:
+        return
+    lo,hi = flat.min(),flat.max()+1
+    if hi-lo <= 4*len(flat):
+        row[lo:hi] += numpy.bincount(flat-lo,minlength=hi-lo).astype(row.dtype)
+    else:
+        numpy.add.at(row,flat,1)
+
+def filter_cache(cache,seq_lims,settings,chunk_size=4194304):
+    '''Filters a <.stops> cache with vectorized masks, returns the same reports and stops as filter_reads'''
+    names,lengths,records = sf3bin.read_stop_cache(cache)
+    layout,total = stop_layout(seq_lims)
+    offsets = numpy.array([layout.get(name,(0,0))[0] for name in names]+[0],dtype=numpy.int64)
+    limits = numpy.array([layout.get(name,(0,0))[1] for name in names]+[0],dtype=numpy.int64)
+    counts = [Counter() for setting in settings]
+    stops = numpy.zeros((len(settings),total),dtype=numpy.int32)
+    for start in range(0,len(records),chunk_size):
+        chunk = records[start:start+chunk_size]
+        transcripts,positions = chunk['transcript'],chunk['position'].astype(numpy.int64)
+        in_ref = (positions >= 0) & (positions < limits[transcripts])
+        flat = offsets[transcripts]+positions
+        for row,(mm,fst,keyflag) in enumerate(settings):
+            bad_flag = (chunk['flag'] & keyflag) != 0
+            mm_ok = ~bad_flag & (chunk['mismatches'] <= mm)
+            mm_fail = ~bad_flag & ~mm_ok
+            fst_ok = numpy.ones(len(chunk),dtype=bool) if fst else chunk['first'] == 0
+            passing = mm_ok & fst_ok
+            counts[row].update({'bitflag':bad_flag.sum(),'passing':passing.sum(),
+                                'mismatches':(mm_fail & fst_ok).sum(),'firstbase':(mm_ok & ~fst_ok).sum(),
+                                'firstbase_and_mismatches':(mm_fail & ~fst_ok).sum()})
+            add_stops(stops[row],flat[passing & in_ref])
+    reports = [Counter({k:int(v) for k,v in count.items() if v}) for count in counts]
+    return reports,stops
+
+def write_cache(reads,seq_lims,out_name):
+    '''Converts parsed alignments into a <.stops> cache against the reference limits'''
+    names = list(seq_lims.keys())
+    return sf3bin.write_stop_cache(out_name,names,[seq_lims[name] for name in names],reads_to_records(reads,seq_lims))
+
+def collect_stops(in_sam,seq_lims,settings,threads=4,cache_name=None):
+    '''Filters a whole alignment input or <.stops> cache, writing and filtering through a cache if named'''
+    if in_sam.endswith('.stops'):
+        return filter_cache(in_sam,seq_lims,settings)
+    reads = read_alignments(in_sam,threads)
+    if cache_name:
+        write_cache(reads,seq_lims,cache_name)
+        return filter_cache(cache_name,seq_lims,settings)
+    return filter_reads(reads,seq_lims,settings)
+
+def write_stops(stops,seq_lims,out_name,background=False):
+    '''Writes a stop buffer laid out by stop_layout as an rtsc file, returns a future if background'''
+    layout = stop_layout(seq_lims)[0]
+    return sfio.write_rtsc({seq:stops[offset:offset+limit] for seq,(offset,limit) in layout.items()},out_name,background=background)
+
+def filter_tag(setting):
+    '''Names a (mismatches,firstmm,keyflag) setting for sweep outputs'''
+    mm,fst,keyflag = setting
+    tags = ['mm'+str(mm)]+(['firstmm'] if fst else [])+(['reverse'] if not keyflag & sf3sam.flag_values['r1_reverse'] else [])
+    return '_'.join(tags)
+
+def rtsc_name(in_sam,out_name=None,tag=None):
+    '''Names the rtsc file for an alignment input, '-' reads from stdin and needs out_name'''
+    if out_name:
+        name = out_name
+    else:
+        base = in_sam[:-3] if in_sam.endswith('.gz') else in_sam
+        if base.endswith(('.bam','.stops')):
+            name = base[:base.rindex('.')]+'.rtsc'
         else:
-            rtsc[seq] = ['0']*limit
-    #Write the stops
-    out_name = in_sam.replace('.sam','.rtsc')
-    sfio.write_rtsc(rtsc,out_name)
-    #Return file specific metrics
-    return report
+            name = base.replace('.sam','.rtsc')
+    return sfio.tag_name(name,'.rtsc',tag) if tag else name
+
+def write_sweep(in_sam,reports,stops,seq_lims,settings,out_name=None):
+    '''Writes one rtsc per setting, returns the log rows keyed by file, tagged when sweeping'''
+    log_data,writing = {},[]
+    for report,row,setting in zip(reports,stops,settings):
+        tag = filter_tag(setting) if len(settings) > 1 else None
+        writing.append(write_stops(row,seq_lims,rtsc_name(in_sam,out_name,tag),background=True))
+        log_data[':'.join([in_sam,tag]) if tag else in_sam] = report
+    for future in writing:
+        future.result()
+    return log_data
+
+def cache_name(in_sam,out_name=None):
+    '''Names the <.stops> cache written for an alignment input, the cache is binary so a <.gz> is dropped'''
+    name = rtsc_name(in_sam,out_name)
+    name = name[:-3] if name.endswith('.gz') else name
+    return (name[:-len('.rtsc')] if name.endswith('.rtsc') else name)+'.stops'
+
+def sam_to_rtsc(in_sam,seq_lims,settings,out_name=None,threads=4,cache=False):
+    '''Takes an alignment file or <.stops> cache and writes rtsc file(s), one per filter setting, returns logs'''
+    cache_out = cache_name(in_sam,out_name) if cache else None
+    reports,stops = collect_stops(in_sam,seq_lims,settings,threads,cache_out)
+    return write_sweep(in_sam,reports,stops,seq_lims,settings,out_name)
+
+def sam_byte_ranges(in_sam,splits):
+    '''Splits the body of a SAM file into line aligned byte ranges, skipping the @ header'''
+    if not os.path.isfile(in_sam) or in_sam.endswith(('.gz','.bam','.stops')):
+        return [(0,None)]
+    with open(in_sam,'rb') as f:
+        start = 0
+        for line in f:
+            if not line.startswith(b'@'):
+                break
+            start += len(line)
+        end = f.seek(0,2)
+        bounds = [start]
+        for i in range(1,splits):
+            f.seek(start+(end-start)*i//splits)
+            f.readline()
+            bounds.append(max(min(f.tell(),end),bounds[-1]))
+        bounds.append(end)
+    return [(a,b) for a,b in zip(bounds,bounds[1:]) if b > a]
+
+def read_sam_range(in_sam,start,end):
+    '''Yields the lines of a SAM file between two line aligned byte offsets'''
+    with open(in_sam,'rb') as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode()
+
+def sam_range_to_stops(in_sam,start,end,settings,threads=4):
+    '''Filters one byte range of a SAM file, end None takes the whole input, returns partial reports and sparse stops'''
+    if end is None:
+        reports,stops = collect_stops(in_sam,sfpool.shared(),settings,threads)
+    else:
+        reports,stops = filter_reads(sf3sam.parse_sam(read_sam_range(in_sam,start,end)),sfpool.shared(),settings)
+    hits = numpy.flatnonzero(stops)
+    return reports,(hits,stops.reshape(-1)[hits])
+
+def merge_partials(partials,seq_lims,settings):
+    '''Reduces partial reports and sparse stops from the ranges of one SAM file'''
+    reports = [Counter() for setting in settings]
+    stops = numpy.zeros((len(settings),stop_layout(seq_lims)[1]),dtype=numpy.int32)
+    for sub_reports,(hits,counts) in partials:
+        for report,sub_report in zip(reports,sub_reports):
+            report.update(sub_report)
+        stops.reshape(-1)[hits] += counts
+    return reports,stops
+
+def pooled_sam_to_rtsc(in_sam,settings,out_name=None,threads=4,cache=False):
+    '''Runs sam_to_rtsc inside a worker process against the shared limits'''
+    return sam_to_rtsc(in_sam,sfpool.shared(),settings,out_name,threads,cache)
+
+def batch_sam_to_rtsc(sam_lyst,seq_lims,settings,workers=1,splits=1,out_name=None,threads=4,cache=False):
+    '''Applies sam_to_rtsc to files, optionally splitting each file into ranges, returns logs by file'''
+    log_data = {}
+    if sam_lyst == ['-']:
+        log_data = sam_to_rtsc('-',seq_lims,settings,out_name,threads,cache)
+        return {k.replace('-','stdin',1):v for k,v in log_data.items()}
+    elif splits > 1 and not cache:
+        jobs = [(fyle,a,b,settings,threads) for fyle in sam_lyst for a,b in sam_byte_ranges(fyle,splits)]
+        partials = sfpool.run_jobs(sam_range_to_stops,jobs,seq_lims,workers)
+        for fyle in sam_lyst:
+            reports,stops = merge_partials([p for job,p in zip(jobs,partials) if job[0] == fyle],seq_lims,settings)
+            log_data.update(write_sweep(fyle,reports,stops,seq_lims,settings,out_name))
+    else:
+        jobs = [(fyle,settings,out_name,threads,cache) for fyle in sam_lyst]
+        for entry in sfpool.run_jobs(pooled_sam_to_rtsc,jobs,seq_lims,workers):
+            log_data.update(entry)
+    return log_data
 
 def write_sam_filter_report(data,out_name):
     '''Writes a report on all the filtering metrics'''
     keyring = sorted(set.union(*map(set,data.values())))
     header = ','.join(['sam_file'] + keyring)
-    with open(out_name,'w') as g:
+    with sfio.open_text(out_name,'w') as g:
         g.write(header+'\n')
         for fyle, sub in sorted(data.items()):
             line = ','.join([fyle]+[str(sub.get(key,0)) for key in keyring])
@@ -56,31 +257,50 @@ def main():
     parser = argparse.ArgumentParser(description='Converts <.sam> into reverse transcriptase stop files <.rtsc>')
     in_files = parser.add_argument_group('Input')
     in_files.add_argument('fasta',default=None,help='Index Fasta File')
-    in_files.add_argument('sam',default=None,help='Input SAM file(s)',nargs='+')
+    in_files.add_argument('sam',default=None,help="Input <.sam>/<.sam.gz>/<.bam>/<.stops> file(s), or a single named pipe or '-' for stdin with -out",nargs='+')
     settings = parser.add_argument_group('Settings')
-    settings.add_argument('-mismatches',type=int,default=3,metavar='<number>',help='[default = 3] Maximum allowed mismatches/indels')
+    settings.add_argument('-mismatches',type=int,default=[3],nargs='+',metavar='<number>',help='[default = 3] Maximum allowed mismatches/indels, several values sweep')
     settings.add_argument('-firstmm',action='store_true',default=False,help='Accept alignments with first base mismatches')
     settings.add_argument('-reverse',action='store_true',default=False,help='Accept alignments to the reverse strand')
+    settings.add_argument('-sweep_firstmm',action='store_true',default=False,help='Sweep both with and without -firstmm')
+    settings.add_argument('-sweep_reverse',action='store_true',default=False,help='Sweep both with and without -reverse')
     settings.add_argument('-rm_secondary',action='store_false',default=True,help='Remove secondary alignments',dest='secondary')
+    settings.add_argument('-workers',type=int,default=1,metavar='<number>',help='[default = 1] Number of worker processes')
+    settings.add_argument('-threads',type=int,default=4,metavar='<number>',help='[default = 4] Decompression threads per <.bam>/<.sam.gz>')
+    settings.add_argument('-split',type=int,default=1,metavar='<number>',help='[default = 1] Split each <.sam> into this many ranges for the workers')
     out_files = parser.add_argument_group('Output')
+    out_files.add_argument('-out',type=str,default=None,metavar='<.rtsc>',help='Output file name, required when reading stdin or a named pipe')
+    out_files.add_argument('-cache',action='store_true',default=False,help='Also write a <.stops> alignment cache per input for fast re-filtering (disables -split)')
     out_files.add_argument('-logname',type=str,default='filter_log.csv',help='[default = filter_log.csv] Log file name')
     parser.set_defaults(r1_unmap=False)
     args = parser.parse_args()
+    if len(args.sam) > 1 and ('-' in args.sam or args.out):
+        parser.error("stdin '-' and -out only take a single SAM input")
+    if args.sam == ['-'] and not args.out:
+        parser.error("reading stdin '-' requires an -out name")
+    for sam in args.sam:
+        if sam != '-' and not args.out and (not os.path.isfile(sam) or rtsc_name(sam) == sam):
+            parser.error('{} is not a regular <.sam>/<.sam.gz>/<.bam>/<.stops> file, it requires an -out name'.format(sam))
+    out_name = sfio.check_extension(args.out,'.rtsc') if args.out else None
 
     #Generate Seq Limits
     reference = sfio.read_fasta(args.fasta)
     limits = {name:len(seq) for name, seq in reference.items()}
 
-    #Generate SAM filterflag
-    keys = {'r1_unmap':args.r1_unmap,'r1_reverse':args.reverse,'secondary':args.secondary}
-    passing_keys = [k for k,v in keys.items() if not v]
-    keyflag = sum([sf3sam.flag_values[R] for R in passing_keys])
+    #Generate SAM filterflag(s) and filter settings
+    firstmms = [False,True] if args.sweep_firstmm else [args.firstmm]
+    reverses = [False,True] if args.sweep_reverse else [args.reverse]
+    settings = []
+    for mm in args.mismatches:
+        for fst in firstmms:
+            for rev in reverses:
+                keys = {'r1_unmap':args.r1_unmap,'r1_reverse':rev,'secondary':args.secondary}
+                passing_keys = [k for k,v in keys.items() if not v]
+                keyflag = sum([sf3sam.flag_values[R] for R in passing_keys])
+                settings.append((mm,fst,keyflag))
 
     #Iterate through files
-    log_data = {}
-    for fyle in args.sam:
-        entry = sam_to_rtsc(fyle,limits,args.mismatches,args.firstmm,keyflag)
-        log_data[fyle] = entry
+    log_data = batch_sam_to_rtsc(args.sam,limits,settings,args.workers,args.split,out_name,args.threads,args.cache)
 
     #Write out log
     write_sam_filter_report(log_data,sfio.check_extension(args.logname,'.csv'))
@@ -0,0 +1,185 @@
+#Imports
+import gzip
+import zlib
+import struct
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+#Classes
+class BgzfWriter(object):
+    '''Text file like BGZF writer, blocks are deflated in parallel by a thread pool and written in order'''
+    def __init__(self,fyle,threads=4,level=6,window=64):
+        self.handle = open(fyle,'wb')
+        self.pool = ThreadPoolExecutor(max(threads,1))
+        self.pending,self.buffer = collections.deque(),bytearray()
+        self.level,self.window = level,window
+
+    def write(self,text):
+        '''Buffers text, submitting every full block for compression'''
+        self.buffer += text.encode()
+        if len(self.buffer) >= BGZF_BLOCK:
+            blocks = len(self.buffer)//BGZF_BLOCK*BGZF_BLOCK
+            for i in range(0,blocks,BGZF_BLOCK):
+                self.pending.append(self.pool.submit(deflate_block,bytes(self.buffer[i:i+BGZF_BLOCK]),self.level))
+            del self.buffer[:blocks]
+            while len(self.pending) > self.window:
+                self.handle.write(self.pending.popleft().result())
+
+    def close(self):
+        '''Compresses what is left, writes all blocks and the EOF marker'''
+        if self.handle.closed:
+            return
+        if self.buffer:
+            self.pending.append(self.pool.submit(deflate_block,bytes(self.buffer),self.level))
+            self.buffer = bytearray()
+        while self.pending:
+            self.handle.write(self.pending.popleft().result())
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+#Functions
+def deflate_block(data,level=6):
+    '''Compresses up to BGZF_BLOCK bytes into one complete BGZF block'''
+    compressor = zlib.compressobj(level,zlib.DEFLATED,-15)
+    payload = compressor.compress(data)+compressor.flush()
+    header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'+struct.pack('<H',len(payload)+25)
+    return header+payload+struct.pack('<II',zlib.crc32(data),len(data))
+
+def is_bgzf(fyle):
+    '''Checks if a file starts with a BGZF block, gzip with a BC extra subfield'''
+    with open(fyle,'rb') as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+def read_bgzf_blocks(f):
+    '''Yields the raw deflate payload of each BGZF block in a binary file handle'''
+    while True:
+        header = f.read(12)
+        if not header:
+            break
+        if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+            raise ValueError('Not a valid BGZF block')
+        xlen = struct.unpack('<H',header[10:12])[0]
+        extra,bsize,i = f.read(xlen),None,0
+        if len(extra) < xlen:
+            raise ValueError('Truncated BGZF block')
+        while i+4 <= xlen:
+            slen = struct.unpack('<H',extra[i+2:i+4])[0]
+            if extra[i:i+2] == b'BC':
+                bsize = struct.unpack('<H',extra[i+4:i+6])[0]
+            i += 4+slen
+        if bsize is None:
+            raise ValueError('BGZF block without a BC subfield')
+        payload = f.read(bsize-xlen-19)
+        if len(payload) < bsize-xlen-19 or len(f.read(8)) < 8:
+            raise ValueError('Truncated BGZF block')
+        yield payload
+
+def inflate(payload):
+    '''Decompresses a raw deflate payload'''
+    return zlib.decompress(payload,-15)
+
+def bgzf_chunks(fyle,threads=4,window=64):
+    '''Yields the decompressed blocks of a BGZF file in order, inflated by a thread pool'''
+    with open(fyle,'rb') as f, ThreadPoolExecutor(max(threads,1)) as pool:
+        pending = collections.deque()
+        for payload in read_bgzf_blocks(f):
+            pending.append(pool.submit(inflate,payload))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def gzip_lines(fyle,threads=4):
+    '''Yields text lines from a gzip file, BGZF files are inflated block parallel'''
+    if not is_bgzf(fyle):
+        with gzip.open(fyle,'rt') as f:
+            yield from f
+        return
+    remainder = b''
+    for chunk in bgzf_chunks(fyle,threads):
+        lines = (remainder+chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line.decode()+'\n'
+    if remainder:
+        yield remainder.decode()
+
+def read_bam(fyle,threads=4):
+    '''Yields (flag,rname,position,mismatches,first) for each BAM record, as sf3sam.parse_sam_line'''
+    chunks = bgzf_chunks(fyle,threads)
+    buf,pos = bytearray(),0
+    def fill(n):
+        '''Makes sure n bytes past pos are buffered, False at end of file'''
+        nonlocal buf,pos
+        while len(buf)-pos < n:
+            chunk = next(chunks,None)
+            if chunk is None:
+                return False
+            del buf[:pos]
+            buf,pos = buf+chunk,0
+        return True
+    #Header
+    if not fill(8) or buf[0:4] != b'BAM\x01':
+        raise ValueError('{} is not a BAM file'.format(fyle))
+    l_text = struct.unpack_from('<i',buf,4)[0]
+    pos += 8
+    if not fill(l_text+4):
+        raise ValueError('{} is a truncated BAM'.format(fyle))
+    pos += l_text
+    n_ref = struct.unpack_from('<i',buf,pos)[0]
+    pos += 4
+    names = []
+    for i in range(n_ref):
+        if not fill(4) or not fill(struct.unpack_from('<i',buf,pos)[0]+8):
+            raise ValueError('{} is a truncated BAM'.format(fyle))
+        l_name = struct.unpack_from('<i',buf,pos)[0]
+        names.append(buf[pos+4:pos+3+l_name].decode())
+        pos += l_name+8
+    #Records
+    core = struct.Struct('<iiiBBHHHi')
+    size = struct.Struct('<i')
+    tag_sizes = {ord(k):v for k,v in {'A':1,'c':1,'C':1,'s':2,'S':2,'i':4,'I':4,'f':4}.items()}
+    int_formats = {ord(k):struct.Struct('<'+v) for k,v in {'c':'b','C':'B','s':'h','S':'H','i':'i','I':'I'}.items()}
+    while fill(4):
+        if not fill(size.unpack_from(buf,pos)[0]+4):
+            raise ValueError('{} is a truncated BAM'.format(fyle))
+        n = len(buf)
+        while pos+4 <= n:
+            end = pos+4+size.unpack_from(buf,pos)[0]
+            if end > n:
+                break
+            block_size,ref_id,ref_pos,l_read_name,_,_,n_cigar,flag,l_seq = core.unpack_from(buf,pos)
+            p = pos+36+l_read_name+4*n_cigar+(l_seq+1)//2+l_seq
+            mismatches,first = 0,False
+            while p < end:
+                tag,kind = buf[p:p+2],buf[p+2]
+                p += 3
+                if kind in tag_sizes:
+                    if tag == b'NM' and kind in int_formats:
+                        mismatches = int_formats[kind].unpack_from(buf,p)[0]
+                    p += tag_sizes[kind]
+                elif kind == 90 or kind == 72:
+                    if tag == b'MD':
+                        first = buf[p] == 48
+                    p = buf.index(0,p)+1
+                elif kind == 66:
+                    sub,count = buf[p],size.unpack_from(buf,p+1)[0]
+                    p += 5+tag_sizes[sub]*count
+                else:
+                    raise ValueError('Unknown BAM tag type {}'.format(chr(kind)))
+            yield flag,names[ref_id] if ref_id >= 0 else '*',ref_pos+1,mismatches,first
+            pos = end
+    if pos < len(buf):
+        raise ValueError('{} is a truncated BAM'.format(fyle))
+
+#Variables
+BGZF_BLOCK = 65280
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
@@ -0,0 +1,126 @@
+#Imports
+import struct
+import itertools
+import numpy
+
+#Functions
+def write_name_table(g,names,lengths):
+    '''Writes a count, then each transcript length and name'''
+    g.write(struct.pack('<I',len(names)))
+    for name,length in zip(names,lengths):
+        encoded = name.encode()
+        g.write(struct.pack('<QH',length,len(encoded))+encoded)
+
+def read_name_table(f):
+    '''Reads a table written by write_name_table, returns names and lengths'''
+    names,lengths = [],[]
+    for i in range(struct.unpack('<I',f.read(4))[0]):
+        length,size = struct.unpack('<QH',f.read(10))
+        names.append(f.read(size).decode())
+        lengths.append(length)
+    return names,lengths
+
+def write_stop_cache(out_name,names,lengths,record_chunks):
+    '''Writes a <.stops> alignment cache from chunks of STOP_DTYPE records, returns the record count'''
+    with open(out_name,'wb') as g:
+        g.write(STOP_MAGIC)
+        write_name_table(g,names,lengths)
+        count_at = g.tell()
+        g.write(struct.pack('<Q',0))
+        count = 0
+        for chunk in record_chunks:
+            g.write(numpy.ascontiguousarray(chunk,dtype=STOP_DTYPE).tobytes())
+            count += len(chunk)
+        g.seek(count_at)
+        g.write(struct.pack('<Q',count))
+    return count
+
+def read_stop_cache(fyle):
+    '''Opens a <.stops> alignment cache, returns names, lengths and a memory mapped record array'''
+    with open(fyle,'rb') as f:
+        if f.read(len(STOP_MAGIC)) != STOP_MAGIC:
+            raise ValueError('{} is not a <.stops> cache'.format(fyle))
+        names,lengths = read_name_table(f)
+        count = struct.unpack('<Q',f.read(8))[0]
+        offset = f.tell()
+    if not count:
+        return names,lengths,numpy.zeros(0,dtype=STOP_DTYPE)
+    return names,lengths,numpy.memmap(fyle,dtype=STOP_DTYPE,mode='r',offset=offset,shape=(count,))
+
+def write_rx_binary(data,out_name,kind):
+    '''Writes a dictionary of <.rtsc> stops or <.react> values ('NA' as NaN) as a binary container'''
+    names = list(data.keys())
+    lengths = [len(data[name]) for name in names]
+    offsets = numpy.array(list(itertools.accumulate([0]+lengths))[:len(names)],dtype='<u8')
+    dtype = RX_DTYPES[kind]
+    with open(out_name,'wb') as g:
+        g.write(RX_MAGIC+struct.pack('<I',RX_KINDS.index(kind)))
+        write_name_table(g,names,lengths)
+        g.write(offsets.tobytes())
+        g.write(bytes(-g.tell() % 8))
+        for name in names:
+            values = data[name]
+            if kind == 'react' and not isinstance(values,numpy.ndarray):
+                values = [numpy.nan if x == 'NA' else x for x in values]
+            g.write(numpy.asarray(values,dtype=dtype).tobytes())
+
+def is_rx_binary(fyle):
+    '''Checks if a file is a binary <.rtsc>/<.react> container'''
+    with open(fyle,'rb') as f:
+        return f.read(len(RX_MAGIC)) == RX_MAGIC
+
+def read_rx_binary(fyle):
+    '''Opens a binary container, returns its kind and a dictionary of memory mapped arrays by transcript'''
+    with open(fyle,'rb') as f:
+        if f.read(len(RX_MAGIC)) != RX_MAGIC:
+            raise ValueError('{} is not a binary <.rtsc>/<.react> file'.format(fyle))
+        kind = RX_KINDS[struct.unpack('<I',f.read(4))[0]]
+        names,lengths = read_name_table(f)
+        offsets = numpy.frombuffer(f.read(8*len(names)),dtype='<u8')
+        start = f.tell()+(-f.tell() % 8)
+    total = sum(lengths)
+    if not total:
+        block = numpy.zeros(0,dtype=RX_DTYPES[kind])
+    else:
+        block = numpy.memmap(fyle,dtype=RX_DTYPES[kind],mode='r',offset=start,shape=(total,))
+    return kind,{name:block[int(o):int(o)+l] for name,o,l in zip(names,offsets,lengths)}
+
+def write_fasta_cache(sequences,out_name,key):
+    '''Writes parsed fasta sequences as a name table and one byte blob, tagged with the source key (path,size,mtime)'''
+    names = list(sequences.keys())
+    encoded = [sequences[name].encode() for name in names]
+    path = key[0].encode()
+    with open(out_name,'wb') as g:
+        g.write(FASTA_MAGIC+struct.pack('<QQH',key[1],key[2],len(path))+path)
+        write_name_table(g,names,[len(seq) for seq in encoded])
+        for seq in encoded:
+            g.write(seq)
+
+def read_fasta_cache(fyle):
+    '''Opens a fasta cache, returns its source key, names, lengths and a memory mapped byte blob'''
+    with open(fyle,'rb') as f:
+        if f.read(len(FASTA_MAGIC)) != FASTA_MAGIC:
+            raise ValueError('{} is not a fasta cache'.format(fyle))
+        size,mtime,path_size = struct.unpack('<QQH',f.read(18))
+        key = (f.read(path_size).decode(),size,mtime)
+        names,lengths = read_name_table(f)
+        start = f.tell()
+    total = sum(lengths)
+    if not total:
+        return key,names,lengths,numpy.zeros(0,dtype='u1')
+    return key,names,lengths,numpy.memmap(fyle,dtype='u1',mode='r',offset=start,shape=(total,))
+
+def rx_to_text(values,kind):
+    '''Converts an array from a binary container to the values of the text formats'''
+    if kind == 'rtsc':
+        return values.tolist()
+    return [float(x) if x != 'nan' else 'NA' for x in values.astype(str).tolist()]
+
+#Variables
+STOP_MAGIC = b'SF3STOP\x01'
+STOP_DTYPE = numpy.dtype([('transcript','<i4'),('position','<i4'),('flag','<u2'),
+                          ('mismatches','<u2'),('first','u1')])
+FASTA_MAGIC = b'SF3FA\x00\x00\x01'
+RX_MAGIC = b'SF3RX\x00\x00\x01'
+RX_KINDS = ['rtsc','react','raw']
+RX_DTYPES = {'rtsc':numpy.dtype('<i4'),'react':numpy.dtype('<f4'),'raw':numpy.dtype('<f8')}
@@ -0,0 +1,76 @@
+#Imports
+import os
+import hashlib
+import sf3libs.sf3bin as sfbin
+
+#Classes
+class StageCache(object):
+    '''Directory of binary stage results named by content key, the least recently used are evicted past max_bytes'''
+    def __init__(self,directory,max_bytes):
+        self.directory,self.max_bytes = directory,max_bytes
+        os.makedirs(directory,exist_ok=True)
+
+    def path(self,key):
+        '''File of a key'''
+        return os.path.join(self.directory,key+'.sf3c')
+
+    def has(self,key):
+        '''Checks for an entry without loading it'''
+        return os.path.isfile(self.path(key))
+
+    def load(self,key):
+        '''Returns the {name:array} of an entry marking it as recently used, None if missing or unreadable'''
+        try:
+            data = sfbin.read_rx_binary(self.path(key))[1]
+            os.utime(self.path(key))
+            return data
+        except (OSError,ValueError):
+            return None
+
+    def store(self,key,data,kind='raw'):
+        '''Writes an entry of {name:array} atomically, then evicts down to the size cap'''
+        temp = self.path(key)+'.{}.tmp'.format(os.getpid())
+        try:
+            sfbin.write_rx_binary(data,temp,kind)
+            os.replace(temp,self.path(key))
+            self.evict()
+        except OSError:
+            if os.path.isfile(temp):
+                os.remove(temp)
+
+    def evict(self):
+        '''Removes the entries used longest ago until the cache fits in max_bytes'''
+        entries = []
+        for fyle in os.listdir(self.directory):
+            if fyle.endswith('.sf3c'):
+                try:
+                    stat = os.stat(os.path.join(self.directory,fyle))
+                    entries.append((stat.st_mtime,stat.st_size,os.path.join(self.directory,fyle)))
+                except OSError:
+                    pass
+        total = sum(size for mtime,size,path in entries)
+        for mtime,size,path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+#Functions
+def file_digest(fyle,block_size=1<<20):
+    '''sha256 of a file's contents'''
+    digest = hashlib.sha256()
+    with open(fyle,'rb') as f:
+        for block in iter(lambda: f.read(block_size),b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def names_digest(names):
+    '''sha256 of a set of names, independent of their order, None for no names'''
+    return None if names is None else hashlib.sha256('\n'.join(sorted(names)).encode()).hexdigest()
+
+def stage_key(*parts):
+    '''Cache key of a stage from its input digests and parameters'''
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
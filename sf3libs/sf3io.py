@@ -1,53 +1,216 @@
 #Imports
+import os
+import hashlib
 import itertools
-from Bio import SeqIO
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import sf3libs.sf3bin as sfbin
+import sf3libs.sf3bam as sfbam
 
 #Functions
 def check_extension(astring,extension):
-    '''Checks and fixes things to have the proper extension'''
-    out_string = astring if astring.endswith(extension) else astring + extension
+    '''Checks and fixes things to have the proper extension, a trailing <.gz> is kept'''
+    out_string = astring if astring.endswith(extension) or astring.endswith(extension+'.gz') else astring + extension
     return out_string 
 
-def read_fasta(afasta):
-    '''Fasta to Python dictionary'''
-    fasta_sequences = SeqIO.parse(open(afasta),'fasta')
-    return {record.id:str(record.seq) for record in fasta_sequences}
+def open_text(fyle,mode='r',threads=4):
+    '''Opens a text file to read or write, <.gz> files are decompressed or BGZF compressed in parallel'''
+    if not fyle.endswith('.gz'):
+        return open(fyle,mode)
+    if mode == 'r':
+        return contextlib.closing(sfbam.gzip_lines(fyle,threads))
+    return sfbam.BgzfWriter(fyle,threads)
 
-def read_rtsc(rtsc_fyle):
-    '''Reads a <.rtsc> file into a dictionary, transcript_name:[list of stop numbers]'''
-    information = {}
-    with open(rtsc_fyle,'r') as f:
-        while True:
-            next_n_lines = list(itertools.islice(f,3))
-            if not next_n_lines:
-                break
-            transcript,stops,empty_line = [n.strip() for n in next_n_lines]
-            information[transcript] = [int(x) for x in stops.split('\t')]
-    return information
-
-def read_react(react_file):
-    '''Reads a <.react> file into a dictionary, transcript_name:[list of reactivities] '''
-    information = {}
-    with open(react_file,'r') as f:
+def read_fasta(afasta,cache_dir=None):
+    '''Fasta to Python dictionary. If given cache_dir (default $SF3_CACHE_DIR), the parsed
+    reference is kept there and reloaded while the fasta path, size and mtime are unchanged'''
+    cache_dir = cache_dir or os.environ.get('SF3_CACHE_DIR')
+    if not cache_dir:
+        return dict(iter_fasta(afasta))
+    key = fasta_key(afasta)
+    cache = os.path.join(cache_dir,hashlib.sha1(key[0].encode()).hexdigest()+'.fcache')
+    if os.path.isfile(cache):
+        try:
+            cached_key,names,lengths,blob = sfbin.read_fasta_cache(cache)
+            if cached_key == key:
+                data,offsets = blob.tobytes(),itertools.accumulate([0]+lengths)
+                return {name:data[o:o+l].decode() for name,o,l in zip(names,offsets,lengths)}
+        except (OSError,ValueError):
+            pass
+    sequences = dict(iter_fasta(afasta))
+    temp = cache+'.{}.tmp'.format(os.getpid())
+    try:
+        os.makedirs(cache_dir,exist_ok=True)
+        sfbin.write_fasta_cache(sequences,temp,key)
+        os.replace(temp,cache)
+    except OSError:
+        if os.path.isfile(temp):
+            os.remove(temp)
+    return sequences
+
+def fasta_key(afasta):
+    '''Identifies a fasta by absolute path, size and modification time'''
+    stat = os.stat(afasta)
+    return os.path.abspath(afasta),stat.st_size,stat.st_mtime_ns
+
+def iter_fasta(afasta):
+    '''Yields (name,sequence) from a fasta one record at a time, the name is the first word of the header'''
+    name,lines = None,[]
+    with open_text(afasta) as f:
+        for line in f:
+            if line.startswith('>'):
+                if name is not None:
+                    yield name,''.join(lines).replace(' ','')
+                name,lines = (line[1:].split(None,1) or [''])[0],[]
+            elif name is not None:
+                lines.append(line.strip())
+    if name is not None:
+        yield name,''.join(lines).replace(' ','')
+
+def read_rtsc(rtsc_fyle,restrict=None,as_array=False):
+    '''Reads a <.rtsc> file into a dictionary, transcript_name:[list of stop numbers], binary files map to arrays.
+    If given restrict, only those transcripts are loaded, seeking to them through the offset index.
+    If as_array, each value line is parsed straight into an integer array'''
+    return dict(iter_rtsc(rtsc_fyle,restrict,as_array))
+
+def iter_rtsc(rtsc_fyle,restrict=None,as_array=False):
+    '''Yields (transcript_name,[list of stop numbers]) from a <.rtsc> one transcript at a time'''
+    if sfbin.is_rx_binary(rtsc_fyle):
+        yield from restrict_keys(sfbin.read_rx_binary(rtsc_fyle)[1],restrict).items()
+        return
+    for transcript,stops,empty_line in read_entries(rtsc_fyle,3,restrict):
+        if as_array:
+            yield transcript,parse_values(stops,numpy.int64)
+        else:
+            yield transcript,[int(x) for x in stops.split('\t')]
+
+def read_react(react_file,restrict=None,as_array=False):
+    '''Reads a <.react> file into a dictionary, transcript_name:[list of reactivities].
+    If given restrict, only those transcripts are loaded, seeking to them through the offset index.
+    If as_array, each value line is parsed straight into a float array with NA as NaN'''
+    return dict(iter_react(react_file,restrict,as_array))
+
+def iter_react(react_file,restrict=None,as_array=False):
+    '''Yields (transcript_name,[list of reactivities]) from a <.react> one transcript at a time'''
+    if sfbin.is_rx_binary(react_file):
+        for transcript,values in restrict_keys(sfbin.read_rx_binary(react_file)[1],restrict).items():
+            yield transcript,values if as_array else sfbin.rx_to_text(values,'react')
+        return
+    for transcript,reactivities in read_entries(react_file,2,restrict):
+        if as_array:
+            yield transcript,parse_values(reactivities.replace('NA','nan'),numpy.float64)
+        else:
+            yield transcript,[float(x) if x!= 'NA' else 'NA' for x in reactivities.split()]
+
+@contextlib.contextmanager
+def rtsc_reader(rtsc_fyle):
+    '''Random access to a <.rtsc> as a context, gives its transcripts in file order and a function reading one transcript's stops.
+    Text files are seeked through the offset index and closed on exit, binary files map their arrays'''
+    if sfbin.is_rx_binary(rtsc_fyle):
+        data = sfbin.read_rx_binary(rtsc_fyle)[1]
+        yield list(data.keys()),data.__getitem__
+        return
+    index = load_index(rtsc_fyle,3)
+    with open(rtsc_fyle,'rb') as f:
+        def read(transcript):
+            offset,length = index[transcript]
+            f.seek(offset)
+            return parse_values(f.read(length).decode().split('\n')[1].strip(),numpy.int64)
+        yield list(index.keys()),read
+
+def parse_values(line,dtype):
+    '''Parses a tab separated value line into an array in one call'''
+    if not line:
+        return numpy.zeros(0,dtype=dtype)
+    return numpy.fromstring(line,dtype=dtype,sep='\t')
+
+def restrict_keys(data,restrict=None):
+    '''Keeps only the restricted keys of a dictionary, all of them if restrict is None'''
+    return data if restrict is None else {k:v for k,v in data.items() if k in restrict}
+
+def read_entries(fyle,size,restrict=None):
+    '''Yields the stripped lines of each entry of size lines, seeking to restricted transcripts via the index.
+    Compressed files cannot be seeked, so they are read through and filtered instead'''
+    if restrict is None or fyle.endswith('.gz'):
+        with open_text(fyle) as f:
+            while True:
+                next_n_lines = list(itertools.islice(f,size))
+                if not next_n_lines:
+                    break
+                if restrict is None or next_n_lines[0].strip() in restrict:
+                    yield [n.strip() for n in next_n_lines]
+    else:
+        index = load_index(fyle,size)
+        with open(fyle,'rb') as f:
+            for transcript,(offset,length) in index.items():
+                if transcript in restrict:
+                    f.seek(offset)
+                    yield [n.strip() for n in f.read(length).decode().split('\n')[:size]]
+
+def index_rx(fyle,size):
+    '''Builds the offset index of a file of size line entries, transcript_name:(byte offset,byte length)'''
+    index,offset = {},0
+    with open(fyle,'rb') as f:
         while True:
-            next_n_lines = list(itertools.islice(f,2))
+            next_n_lines = list(itertools.islice(f,size))
             if not next_n_lines:
                 break
-            transcript,reactivities = [n.strip() for n in next_n_lines]
-            information[transcript] = [float(x) if x!= 'NA' else 'NA' for x in reactivities.split()]
-    return information
+            length = sum(map(len,next_n_lines))
+            index[next_n_lines[0].strip().decode()] = (offset,length)
+            offset += length
+    return index
+
+def load_index(fyle,size):
+    '''Reads the <.idx> sidecar of a <.rtsc>/<.react>, building and saving it if missing, stale or damaged.
+    The sidecar header records the size and mtime (ns) of the file it indexes, which must match exactly, and its entry count'''
+    sidecar,stat = fyle+'.idx',os.stat(fyle)
+    key = ['#',str(stat.st_size),str(stat.st_mtime_ns)]
+    index = read_index(sidecar,key) if os.path.isfile(sidecar) else None
+    if index is None:
+        index = index_rx(fyle,size)
+        write_index(index,sidecar,key)
+    return index
+
+def read_index(sidecar,key):
+    '''Reads an <.idx> sidecar written under key, None if its key differs or it is cut short or malformed'''
+    try:
+        with open(sidecar,'r') as f:
+            header = f.readline().rstrip('\n').split('\t')
+            if header[:-1] != key:
+                return None
+            index = {}
+            for line in f:
+                transcript,offset,length = line.rstrip('\n').split('\t')
+                index[transcript] = (int(offset),int(length))
+    except (OSError,ValueError,UnicodeDecodeError):
+        return None
+    return index if header[-1] == str(len(index)) else None
+
+def write_index(index,sidecar,key):
+    '''Writes an <.idx> sidecar atomically, its header is key and the entry count'''
+    temp = sidecar+'.{}.tmp'.format(os.getpid())
+    try:
+        with open(temp,'w') as g:
+            g.write('\t'.join(key+[str(len(index))])+'\n')
+            for transcript,(offset,length) in index.items():
+                g.write('\t'.join([transcript,str(offset),str(length)])+'\n')
+        os.replace(temp,sidecar)
+    except OSError:
+        if os.path.isfile(temp):
+            os.remove(temp)
 
 def read_restrict(coverage_overlap):
     '''Reads in a standard overlapped coverage file'''
     info = {}
-    with open(coverage_overlap,'r') as f:
+    with open_text(coverage_overlap) as f:
         for line in f:
             info[line.strip()] = None
     return info
 
 def write_fasta(info,outfyle='out.fasta',sort_flag=False,line_width=80):
     '''Writes out a dictionary as a <.fasta>, line_width controls chars per line'''
-    with open(outfyle,'w') as g:
+    with open_text(outfyle,'w') as g:
         if sort_flag:
             for name,seq in sorted(info.items()):
                 g.write('>'+ name+'\n')
@@ -59,40 +222,66 @@ def write_fasta(info,outfyle='out.fasta',sort_flag=False,line_width=80):
                 for i in range(0,len(seq),line_width):
                     g.write(seq[i:i+line_width]+'\n')
 
-def write_react(react_dictionary,outfile='data.react',sort_flag=False):
-    '''Writes out a dictionary as a <.react> file'''
-    with open(outfile,'w') as g:
-        if sort_flag:
-            for transcript, entry in sorted(react_dictionary.items()):
-                g.write(transcript+'\n')
-                g.write('\t'.join([str(number) for number in entry])+'\n')
-        else:
-            for transcript, entry in react_dictionary.items():
-                g.write(transcript+'\n')
-                g.write('\t'.join([str(number) for number in entry])+'\n')
+def write_react(react_dictionary,outfile='data.react',sort_flag=False,background=False):
+    '''Writes out a dictionary as a <.react> file, entries may be lists or float arrays with NaN as NA'''
+    return write_entries(react_dictionary,outfile,join_reactivities,'\n',sort_flag,background)
 
-def write_rtsc(rtsc_dictionary,outfile='data.rtsc',sort_flag=False):
-    '''Writes out a dictionary as a <.rtsc> file'''
-    with open(outfile,'w') as g:
-        if sort_flag:
-            for transcript, entry in sorted(rtsc_dictionary.items()):
-                g.write(transcript+'\n')
-                g.write('\t'.join([str(number) for number in entry])+'\n\n')
-        else:
-            for transcript, entry in rtsc_dictionary.items():
-                g.write(transcript+'\n')
-                g.write('\t'.join([str(number) for number in entry])+'\n\n')
+def write_rtsc(rtsc_dictionary,outfile='data.rtsc',sort_flag=False,background=False):
+    '''Writes out a dictionary, or an iterable of (transcript,stops) written as it is consumed, as a <.rtsc> file.
+    Entries may be lists or integer arrays'''
+    return write_entries(rtsc_dictionary,outfile,join_values,'\n\n',sort_flag,background)
+
+def write_entries(data,outfile,formatter,trailer,sort_flag=False,background=False,buffer_size=1<<20):
+    '''Writes name, formatted values and trailer per transcript through a large buffer.
+    If background, formatting and writing run on a thread and a future is returned'''
+    if background:
+        executor = ThreadPoolExecutor(1)
+        future = executor.submit(write_entries,data,outfile,formatter,trailer,sort_flag,False,buffer_size)
+        executor.shutdown(wait=False)
+        return future
+    items = data.items() if isinstance(data,dict) else data
+    items = sorted(items) if sort_flag else items
+    with open_text(outfile,'w') as g:
+        buffer,size = [],0
+        for transcript, entry in items:
+            buffer.append(transcript+'\n'+formatter(entry)+trailer)
+            size += len(buffer[-1])
+            if size >= buffer_size:
+                g.write(''.join(buffer))
+                buffer,size = [],0
+        g.write(''.join(buffer))
+
+def join_values(entry):
+    '''Tab joins a list of values, small non-negative integer arrays are formatted by table lookup'''
+    if hasattr(entry,'tolist'):
+        if len(entry) and 0 <= entry.min() and entry.max() < len(INT_STRINGS):
+            return '\t'.join(INT_STRINGS[entry].tolist())
+        entry = entry.tolist()
+    return '\t'.join(map(str,entry))
+
+def join_reactivities(entry):
+    '''Tab joins a list of reactivities, NaN in arrays is written as NA.
+    Arrays holding only whole thousandths, as rounded reactivities do, are formatted by table lookup'''
+    if hasattr(entry,'tolist'):
+        values = numpy.asarray(entry,dtype=float)
+        missing = numpy.isnan(values)
+        scaled = numpy.round(values*1000)
+        scaled[missing] = -1
+        if (scaled < len(THOUSANDTHS)-1).all() and (missing | (scaled/1000 == values) & ~numpy.signbit(values)).all():
+            return '\t'.join(THOUSANDTHS[scaled.astype(numpy.int64)].tolist())
+        return '\t'.join(map(str,values.tolist())).replace('nan','NA')
+    return '\t'.join(map(str,entry))
 
 def write_keys(info,outfyle):
     '''Writes out a flat list of transcripts'''
-    with open(outfyle,'w') as g:
+    with open_text(outfyle,'w') as g:
         for transcript in info.keys():
             g.write(transcript+'\n')
 
-def read_rx_files(rx_files,mode,verbose=True):
-    '''Takes a list of rx files, returns nested dictionary'''
+def read_rx_files(rx_files,mode,verbose=True,restrict=None,as_array=False):
+    '''Takes a list of rx files, returns nested dictionary, optionally only of restricted transcripts or as arrays'''
     functions = {'rtsc':read_rtsc,'react':read_react}
-    rx_data = {fyle:functions[mode](fyle) for fyle in rx_files}
+    rx_data = {fyle:functions[mode](fyle,restrict,as_array) for fyle in rx_files}
     if verbose:
         print('File','Transcripts',sep=',')
         for k, v in rx_data.items():
@@ -101,24 +290,51 @@ def read_rx_files(rx_files,mode,verbose=True):
         print('Shared between all files',len(common_keys),sep=',')
     new = {}
     for f_name, sub_dict in rx_data.items():
-        s_name = rm_ext(f_name,'.rtsc','.react')
+        s_name = rx_stem(f_name)
         for transcript, data in sub_dict.items():
             new.setdefault(transcript,{})[s_name] = data
     return new
             
+def rx_stem(fyle):
+    '''Name of a <.rtsc>/<.react> file without its extension, text, compressed or binary'''
+    return rm_ext(fyle,'.brtsc','.breact','.rtsc','.react','.gz')
+
+def rx_rename(fyle,extension):
+    '''Swaps the extension of a <.rtsc>/<.react> file, text, compressed or binary, for another, a trailing <.gz> is kept'''
+    return rx_stem(fyle)+extension+('.gz' if fyle.endswith('.gz') else '')
+
+def rx_kind(fyle):
+    '''Kind of a <.rtsc>/<.react> file, 'rtsc' or 'react', from a binary file's header or the extension, None if neither'''
+    if os.path.isfile(fyle) and sfbin.is_rx_binary(fyle):
+        kind = sfbin.read_rx_binary(fyle)[0]
+        return kind if kind in ('rtsc','react') else None
+    stem = fyle[:-3] if fyle.endswith('.gz') else fyle
+    return next((kind for kind in ('rtsc','react') if stem.endswith('.'+kind)),None)
+
 def rm_ext(astring,*extensions):
     '''Removes all given extensions'''
     for ext in extensions:
         astring = astring.replace(ext,'')
     return astring
 
+def tag_name(astring,extension,tag):
+    '''Inserts _tag ahead of the extension of a name, a trailing <.gz> is kept'''
+    gz = '.gz' if astring.endswith('.gz') else ''
+    stem = astring[:len(astring)-len(gz)]
+    stem = stem[:-len(extension)] if stem.endswith(extension) else stem
+    return stem+('_'+tag if tag else '')+extension+gz
+
 def flatten_list(nested_list):
     '''flattens a list'''
     return [lemon for lime in nested_list for lemon in lime] 
 
 def write_params_log(params,out_name):
     '''Writes parameter log'''
-    with open(out_name,'w') as g:
+    with open_text(out_name,'w') as g:
         g.write(','.join(['Parameter','Value'])+'\n')
         for p,v in sorted(vars(params).items()):
             g.write(','.join([p,str(v)])+'\n')
+
+#Variables
+INT_STRINGS = numpy.array([str(i) for i in range(4096)],dtype=object)
+THOUSANDTHS = numpy.array([str(i/1000) for i in range(16384)]+['NA'],dtype=object)
@@ -0,0 +1,27 @@
+'''
+Process pools over jobs that share one large read only object, such as a reference or a control.
+The object is handed to each worker once, by the pool initializer, rather than pickled with every job,
+and job functions read it back through shared(). Without a pool the jobs run in order in this process.
+'''
+
+#Imports
+import multiprocessing
+
+#Functions
+def init_worker(reference):
+    '''Shares the reference object with a worker process'''
+    global worker_reference
+    worker_reference = reference
+
+def shared():
+    '''The reference object shared with this process by init_worker'''
+    return worker_reference
+
+def run_jobs(function,jobs,reference,workers=1):
+    '''Runs function over jobs with reference shared, in a process pool if workers > 1, results keep job order'''
+    if workers > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(min(workers,len(jobs)),initializer=init_worker,initargs=(reference,)) as pool:
+            return pool.starmap(function,jobs,chunksize=1)
+    else:
+        init_worker(reference)
+        return [function(*job) for job in jobs]
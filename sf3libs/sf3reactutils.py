@@ -10,9 +10,12 @@ import numpy
 class ReactStats(object):
     '''Just holds all the components of an entry in a clean way'''
     def __init__(self,react_vector=[],trim=0,minlen=0):
-        if react_vector:
+        if len(react_vector):
             vektor = react_vector[:-trim] if trim else react_vector
-            vektor = filter(lambda x: isinstance(x, float),vektor)
+            if isinstance(vektor,numpy.ndarray):
+                vektor = vektor[~numpy.isnan(vektor)]
+            else:
+                vektor = numpy.array([x for x in vektor if isinstance(x, float)])
             if len(vektor) >= minlen:
                 try:
                     self.mahx = max(vektor)
@@ -31,14 +34,11 @@ class ReactStats(object):
 
 #Functions
 def gini(list_of_values):
-    '''Returns the Gini value of a list of values.'''
-    try:
-        sorted_list = sorted(list_of_values)
-        height, area = 0, 0
-        for value in sorted_list:
-            height += value
-            area += height - value / 2.
-        fair_area = height * len(list_of_values) / 2.
-        return (fair_area - area) / fair_area
-    except ZeroDivisionError:
-        return 'NA'
\ No newline at end of file
+    '''Returns the Gini value of a list or array of values.'''
+    sorted_values = numpy.sort(numpy.asarray(list_of_values,dtype=float))
+    heights = numpy.cumsum(sorted_values)
+    fair_area = heights[-1] * len(sorted_values) / 2. if len(sorted_values) else 0
+    if not fair_area:
+        return 'NA'
+    area = (heights - sorted_values / 2.).sum()
+    return float((fair_area - area) / fair_area)
@@ -4,42 +4,61 @@ import re
 #Classes
 class MappedRead(object):
     '''Mapped Read in a SAM file'''
+    __slots__ = ('fields','flag','rname','pos','mismatches','first')
     def __init__(self,sam_line):
-        fields = sam_line.strip().split()
-        #Assign Base Attributes
-        attributes = ('qname','bitflag','rname','position','mapq',
-            'cigar','rnext','pnext','tlen','sequence','quality')
-        for attribute,field in zip(attributes,fields):
-            setattr(self,attribute,field)
-        #Assign derived and optional attributes
-        optionals = {o.split(':')[0]:o.split(':')[2] for o in fields[11:]}
-        #Get Derived Attributes
-        self.mismatches = int(optionals.get('NM',0))
-        MD = optionals.get('MD','Null')
-        self.first = MD.startswith('0')
-        self.snps = re.findall("\d+[A-Z]|\d+\^[A-Z]+|\d+",MD)
+        self.fields = sam_line.split()
+        self.flag,self.rname,self.pos,self.mismatches,self.first = parse_fields(self.fields)
+
+    qname = property(lambda self: self.fields[0])
+    bitflag = property(lambda self: self.fields[1])
+    position = property(lambda self: self.fields[3])
+    mapq = property(lambda self: self.fields[4])
+    cigar = property(lambda self: self.fields[5])
+    rnext = property(lambda self: self.fields[6])
+    pnext = property(lambda self: self.fields[7])
+    tlen = property(lambda self: self.fields[8])
+    sequence = property(lambda self: self.fields[9])
+    quality = property(lambda self: self.fields[10])
+
+    @property
+    def snps(self):
+        '''MD tag broken into matches, mismatches and deletions, only built when asked'''
+        optionals = {o.split(':')[0]:o.split(':')[2] for o in self.fields[11:]}
+        return re.findall(r"\d+[A-Z]|\d+\^[A-Z]+|\d+",optionals.get('MD','Null'))
 
     def pass_bitflag(self,bitflag):
         '''Checks for unaccepted bits in a bitflag'''
-        A,B = map(flag_to_bin,[self.bitflag,bitflag])
-        bad_flag = any([a+b=='11' for a,b in zip(A,B)])
-        result = False if bad_flag else True
-        return result
+        return not self.flag & int(bitflag)
 
     def pass_mismatches(self,number):
         '''Checks if this read exceeds number of mismatches'''
         return number >= self.mismatches
-    
+
     def pass_first(self,accept):
         '''Given False/True, checks status of first base'''
-        if not accept and not self.first:
-            return True
-        elif not accept and self.first:
-            return False
-        else:
-            return True
+        return accept or not self.first
 
 #Functions
+def parse_fields(fields):
+    '''Returns (flag,rname,position,mismatches,first) from split SAM fields'''
+    mismatches,first = 0,False
+    for tag in fields[11:]:
+        if tag.startswith('NM:'):
+            mismatches = int(tag[5:])
+        elif tag.startswith('MD:'):
+            first = tag.startswith('0',5)
+    return int(fields[1]),fields[2],int(fields[3]),mismatches,first
+
+def parse_sam_line(sam_line):
+    '''Fast path SAM parser, returns (flag,rname,position,mismatches,first)'''
+    return parse_fields(sam_line.split())
+
+def parse_sam(sam_lines):
+    '''Yields parse_sam_line tuples for the alignment lines of a SAM, skipping @ headers'''
+    for line in sam_lines:
+        if not line.startswith('@'):
+            yield parse_fields(line.split())
+
 def flag_to_bin(flag):
     '''Converts a SAM bitflag into binary'''
     return bin(int(flag)).replace('0b','').zfill(12)
@@ -0,0 +1,212 @@
+'''
+Single pass <.rtsc> scanner shared by coverage, specificity and abundances.
+Stops from position 1 on are matched to the upper cased sequence minus its last base. The reference is
+indexed once (ReferenceIndex): base codes per transcript, and per specificity a base mask and count.
+Per file and transcript, coverage is then a dot product of the stops with the mask, stops per base are
+one bincount, and the total stops and length are kept for abundances.
+'''
+
+#Imports
+import os
+import numpy
+import sf3libs.sf3io as sfio
+
+#Classes
+class ReferenceIndex(object):
+    '''Base codes of each transcript of a reference, with the masks and counts of its specific bases per specificity'''
+    def __init__(self,fasta_index,specificities=()):
+        self.names = list(fasta_index.keys())
+        self.rows = {name:row for row,name in enumerate(self.names)}
+        self.codes = {name:base_codes(sequence) for name,sequence in fasta_index.items()}
+        self.masks,self.counts = {},{}
+        for bases in specificities:
+            self.add_specificity(bases)
+
+    def add_specificity(self,bases):
+        '''Builds the masks and specific base counts of one specificity'''
+        if bases not in self.masks:
+            accepted = letter_table(bases)
+            self.masks[bases] = {name:accepted[codes] for name,codes in self.codes.items()}
+            self.counts[bases] = numpy.array([self.masks[bases][name].sum() for name in self.names],dtype=numpy.int64)
+
+class CoverageMatrix(object):
+    '''Coverage of transcripts (rows) by samples (columns), NaN where a sample lacks the transcript.
+    Rows of unspecific transcripts, without any specific base, hold 0 wherever present'''
+    def __init__(self,transcripts,samples,values,unspecific):
+        self.transcripts,self.samples = list(transcripts),list(samples)
+        self.values,self.unspecific = values,unspecific
+
+    def covered(self):
+        '''Rows present in any sample, ordered by transcript name'''
+        present = numpy.flatnonzero(~numpy.isnan(self.values).all(axis=1)).tolist()
+        return sorted(present,key=self.transcripts.__getitem__)
+
+    def columns(self):
+        '''Columns ordered by sample name'''
+        return sorted(range(len(self.samples)),key=self.samples.__getitem__)
+
+#Functions
+def base_codes(sequence):
+    '''Upper cased sequence minus its last base as a uint8 array, the bases stops from position 1 on land after'''
+    return numpy.frombuffer(sequence.upper()[:-1].encode(),dtype=numpy.uint8)
+
+def letter_codes(letters):
+    '''Byte codes of a set of letters'''
+    return numpy.unique(numpy.frombuffer(letters.encode(),dtype=numpy.uint8))
+
+def letter_table(letters):
+    '''Byte lookup table, True at the codes of a set of letters'''
+    accepted = numpy.zeros(256,dtype=bool)
+    accepted[letter_codes(letters)] = True
+    return accepted
+
+def specificity_mask(sequence,specificity):
+    '''Boolean array of the sequence positions whose base is in specificity, letters match as given'''
+    return letter_table(specificity)[numpy.frombuffer(sequence.encode(),dtype=numpy.uint8)]
+
+def scan_rtsc(rtsc_file,reference=None,specificities=(),letters=True):
+    '''Scans an <.rtsc> once, returns coverage per specificity {bases:array by reference row, NaN if absent},
+    stops per base {letter:count} over all transcripts (if letters) and {transcript:(total stops,length)}.
+    Without a ReferenceIndex only the totals are collected'''
+    for bases in (specificities if reference else []):
+        reference.add_specificity(bases)
+    coverages = {bases:numpy.full(len(reference.names),numpy.nan) for bases in specificities} if reference else {}
+    letter_stops,letter_seen,totals = numpy.zeros(256,dtype=numpy.int64),numpy.zeros(256,dtype=bool),{}
+    for transcript,stops in sfio.iter_rtsc(rtsc_file,as_array=True):
+        totals[transcript] = (int(stops.sum()),len(stops))
+        if reference is None:
+            continue
+        row,codes = reference.rows[transcript],reference.codes[transcript]
+        size = min(len(codes),max(len(stops)-1,0))
+        effective_stops = stops[1:size+1]
+        if letters:
+            letter_stops += numpy.bincount(codes[:size],weights=effective_stops,minlength=256).astype(numpy.int64)
+            letter_seen[codes[:size]] = True
+        for bases,column in coverages.items():
+            specific_bases = reference.counts[bases][row]
+            specific_stops = int(numpy.dot(effective_stops,reference.masks[bases][transcript][:size]))
+            column[row] = specific_stops/specific_bases if specific_bases else 0.0
+    found = {chr(code):int(letter_stops[code]) for code in numpy.flatnonzero(letter_seen).tolist()}
+    return coverages,found,totals
+
+def scan_files(rtsc_files,reference=None,specificities=(),letters=True):
+    '''Applies scan_rtsc to files, returns {file:(coverages,letters,totals)} keyed by name without extension'''
+    return {sfio.rx_stem(fyle):scan_rtsc(fyle,reference,specificities,letters) for fyle in rtsc_files}
+
+def coverage_matrix(scans,reference,bases):
+    '''CoverageMatrix of one specificity from the scans of scan_files'''
+    samples = list(scans.keys())
+    values = numpy.column_stack([scans[sample][0][bases] for sample in samples]) if samples else numpy.zeros((len(reference.names),0))
+    return CoverageMatrix(reference.names,samples,values,reference.counts[bases] == 0)
+
+def merge_coverage(old,new):
+    '''Adds the samples of a new CoverageMatrix to an old one, samples in both are taken from new, rows match by transcript'''
+    new_rows = set(new.transcripts)
+    transcripts = new.transcripts+[transcript for transcript in old.transcripts if transcript not in new_rows]
+    rows = {transcript:row for row,transcript in enumerate(transcripts)}
+    kept = [column for column,sample in enumerate(old.samples) if sample not in new.samples]
+    old_rows = [rows[transcript] for transcript in old.transcripts]
+    values = numpy.full((len(transcripts),len(kept)+len(new.samples)),numpy.nan)
+    values[numpy.ix_(old_rows,range(len(kept)))] = old.values[:,kept]
+    values[:len(new.transcripts),len(kept):] = new.values
+    unspecific = numpy.zeros(len(transcripts),dtype=bool)
+    unspecific[old_rows] = old.unspecific
+    unspecific[:len(new.transcripts)] |= new.unspecific
+    return CoverageMatrix(transcripts,[old.samples[column] for column in kept]+new.samples,values,unspecific)
+
+def read_coverage(coverage_file):
+    '''Reads a coverage <.csv> into a CoverageMatrix, through its <.npz> sidecar if that is current.
+    Returns the matrix and the specificity recorded in the sidecar, None if read from the <.csv>'''
+    sidecar = coverage_file+'.npz'
+    with sfio.open_text(coverage_file) as f:
+        header = next(iter(f)).strip().split(',')
+        samples = [column[:-len('_coverage')] if column.endswith('_coverage') else column for column in header[1:]]
+        if os.path.isfile(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(coverage_file):
+            with numpy.load(sidecar) as stored:
+                if stored['samples'].tolist() == samples:
+                    matrix = CoverageMatrix(stored['transcripts'].tolist(),samples,stored['values'],stored['unspecific'])
+                    return matrix,str(stored['bases'])
+        transcripts,values,unspecific = [],[],[]
+        for line in f:
+            fields = line.strip().split(',')
+            transcripts.append(fields[0])
+            values.append([numpy.nan if x == 'NA' else float(x) for x in fields[1:]])
+            unspecific.append('0' in fields[1:])
+    values = numpy.array(values,dtype=float).reshape(len(transcripts),len(samples))
+    return CoverageMatrix(transcripts,samples,values,numpy.array(unspecific,dtype=bool)),None
+
+def write_coverage_sidecar(matrix,out_fyle,bases):
+    '''Writes a CoverageMatrix and its specificity as a <.npz>'''
+    with open(out_fyle,'wb') as g:
+        numpy.savez(g,transcripts=numpy.array(matrix.transcripts,dtype=str),samples=numpy.array(matrix.samples,dtype=str),
+                    values=matrix.values,unspecific=matrix.unspecific,bases=numpy.array(bases))
+
+def values_to_TPM(data):
+    '''Calculates TPM or Transcripts Per Kilobase Million reads'''
+    reads_per_kb = {k:v[0]/(float(v[1])/1000) for k, v in data.items()}
+    normalize = sum(reads_per_kb.values())/1000000
+    TPM_values = {k:v/normalize for k,v in reads_per_kb.items()}
+    return TPM_values
+
+def values_to_RPKM(data):
+    '''Calculates RPKM or Reads Per Kilobase per Million reads'''
+    norm = sum(v[0] for v in data.values())
+    RPKM_values = {k:(float(v[0])*1000*1000000)/(v[1]*norm) for k, v in data.items()}
+    return RPKM_values
+
+def abundance_table(totals,mode):
+    '''Nested {transcript:{file:abundance}} from the {file:{transcript:(total stops,length)}} of scans, mode RPKM or TPM'''
+    new = {}
+    for f_name, sub_dict in totals.items():
+        for transcript, value in ABUNDANCE_METHODS[mode](sub_dict).items():
+            new.setdefault(transcript,{})[f_name] = value
+    return new
+
+def write_coverage(matrix,out_fyle='derp.csv',bases=None):
+    '''Writes out the coverages of a CoverageMatrix, and if given its specificity bases a <.npz> sidecar to update it by'''
+    columns = matrix.columns()
+    header = ','.join(['transcript']+[matrix.samples[column]+'_coverage' for column in columns])
+    with sfio.open_text(out_fyle,'w') as g:
+        g.write(header+'\n')
+        for row in matrix.covered():
+            values = matrix.values[row,columns].tolist()
+            if matrix.unspecific[row]:
+                entry = ['NA' if value != value else '0' for value in values]
+            else:
+                entry = ['NA' if value != value else str(value) for value in values]
+            g.write(','.join([matrix.transcripts[row]]+entry)+'\n')
+    if bases:
+        write_coverage_sidecar(matrix,out_fyle+'.npz',bases)
+
+def write_ol(matrix,out_fyle='derp.txt',threshold=1.0):
+    '''Writes out an overlap file, the transcripts at or above threshold in every sample'''
+    passing = (matrix.values >= threshold).all(axis=1)
+    with sfio.open_text(out_fyle,'w') as g:
+        for row in matrix.covered():
+            if passing[row]:
+                g.write(matrix.transcripts[row]+'\n')
+
+def write_specificity(adict,outfyle,allowed,rnumb=5):
+    '''Writes all the specificity data to a <.csv>'''
+    cols = ['file','base','count','specificity']
+    with sfio.open_text(outfyle,'w') as g:
+        g.write(','.join(cols)+'\n')
+        for fyle,sub in sorted(adict.items()):
+            for letter,value in sorted(sub.items()):
+                if letter in allowed:
+                    line = [fyle,letter,value,round(value/sum(sub.values()),rnumb)]
+                    g.write(','.join([str(x) for x in line])+'\n')
+
+def write_abundances(data,outname,suffix,missing):
+    '''Writes the nested abundances of abundance_table to a <.csv>'''
+    f_keys = sorted(list(set.union(*map(set, data.values()))))
+    transcript_keys = sorted(data.keys())
+    header = ['transcript']+['_'.join([fyle,suffix]) for fyle in f_keys]
+    with sfio.open_text(outname,'w') as g:
+        g.write(','.join(header)+'\n')
+        for transcript in transcript_keys:
+            entry = [str(data[transcript].get(fyle,missing)) for fyle in f_keys]
+            g.write(','.join([transcript]+entry)+'\n')
+
+#Variables
+ABUNDANCE_METHODS = {'RPKM':values_to_RPKM,'TPM':values_to_TPM}
@@ -0,0 +1,71 @@
+'''
+Deterministic mergeable quantile sketch, a compactor stack in the style of
+Manku-Rajagopalan-Lindsay and KLL with a fixed capacity k per level.
+
+Level h holds items of weight 2**h. Once a level holds k or more items it is sorted,
+every other item (alternating the starting offset) is promoted to level h+1 and the
+rest are dropped. Each compaction at level h moves the rank of any value by at most
+2**h, and a stream of n values causes at most n/(k*2**h) compactions there, so
+over the log2(n/k)+1 levels the rank error of any query is at most n*(log2(n/k)+1)/k.
+Merging concatenates levels and compacts again, so the bound holds for the merged n.
+'''
+
+#Imports
+import math
+import numpy
+
+#Classes
+class QuantileSketch(object):
+    '''Streaming quantile summary of float values, see the module docstring for the error bound'''
+    def __init__(self,k=4096):
+        self.k,self.n = k,0
+        self.levels,self.offsets = [numpy.zeros(0)],[0]
+
+    def update(self,values):
+        '''Adds an array of values'''
+        values = numpy.asarray(values,dtype=float).ravel()
+        self.n += len(values)
+        self.levels[0] = numpy.concatenate([self.levels[0],values])
+        self.compact()
+
+    def merge(self,other):
+        '''Folds another sketch of the same capacity into this one'''
+        if other.k != self.k:
+            raise ValueError('Cannot merge sketches of capacity {} and {}'.format(self.k,other.k))
+        self.n += other.n
+        for h,items in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(numpy.zeros(0))
+                self.offsets.append(0)
+            self.levels[h] = numpy.concatenate([self.levels[h],items])
+        self.compact()
+        return self
+
+    def compact(self):
+        '''Promotes every other item of each full level, an odd item out stays behind'''
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) >= self.k:
+                items = numpy.sort(self.levels[h])
+                even = len(items)-len(items)%2
+                if h+1 == len(self.levels):
+                    self.levels.append(numpy.zeros(0))
+                    self.offsets.append(0)
+                self.levels[h+1] = numpy.concatenate([self.levels[h+1],items[self.offsets[h]:even:2]])
+                self.levels[h] = items[even:]
+                self.offsets[h] ^= 1
+            h += 1
+
+    def quantile(self,q):
+        '''Smallest kept value whose weighted rank reaches q*n'''
+        values = numpy.concatenate(self.levels)
+        if not len(values):
+            raise ValueError('Empty sketch')
+        weights = numpy.concatenate([numpy.full(len(items),2**h) for h,items in enumerate(self.levels)])
+        order = numpy.argsort(values,kind='stable')
+        ranks = numpy.cumsum(weights[order])
+        return float(values[order][min(numpy.searchsorted(ranks,q*ranks[-1]),len(values)-1)])
+
+    def error_bound(self):
+        '''Largest possible rank error of a query, zero until the first compaction'''
+        return 0 if self.n < self.k else self.n*(math.log2(self.n/self.k)+1)/self.k